@@ -1,6 +1,9 @@
 from _Utils.numpy import np, ax
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from _Utils.os_wrapper import os
+import _Utils.versions as versions
 
 from B_Model.AbstractModel import Model as AbstactModel
 
@@ -10,6 +13,7 @@ import _Utils.Color as C
 from _Utils.Color import prntC
 from _Utils.ProgressBar import ProgressBar
 from B_Model.ReplaySolver.Utils import hashing
+from B_Model.ReplaySolver.Utils.index import HashIndex, save_fingerprints, open_fingerprints, __expand__
 
 
 # |====================================================================================================================
@@ -20,6 +24,8 @@ from B_Model.ReplaySolver.Utils import hashing
 PBM_NAME = os.path.dirname(os.path.abspath(__file__)).split("/")[-1]
 BAR = ProgressBar()
 
+UNKNOWN = "Unknown-flight"
+
 
 
 class Model(AbstactModel):
@@ -36,7 +42,7 @@ class Model(AbstactModel):
         self.CTX = CTX
         self.MIN_CHANGE = 3
         self.ts = {}
-        self.hashes = {}
+        self.index = HashIndex()
 
 
 
@@ -59,27 +65,197 @@ class Model(AbstactModel):
         Make prediction for x
         """
         start = time.time()
-        serialized_x = []
-        serialized_y = []
-        for s in range(len(x)):
-            sample = x[s]
-
-            sx, sy = hashing.serialize_lat_lon(FG.lat(sample), FG.lon(sample), self.CTX)
-            d = np.sqrt(sx**2 + sy**2)
-            sx[d > 0.0001] = 0
-            sy[d > 0.0001] = 0
-
-            serialized_x.append(sx)
-            serialized_y.append(sy)
 
         # convert files to fingerprint
         print("comparing !")
-        ts = []
-        for i in range(len(serialized_x)):
-            ts.append(hashing.make_fingerprint(serialized_x[i], serialized_y[i], self.CTX))
+        labels, offsets = self.__fingerprint_batch__(x)
+        ts = [labels[offsets[s]:offsets[s+1]] for s in range(len(x))]
+
+        if (self.CTX["PLOT_HASHED_TIMESERIES"]):
+            self.plot_hashed_timeseries(ts, y, self.ARTIFACTS+"/hashed_timeseries.png")
 
+        # match all the timeseries at once
+        best, score, runner_up, runner_up_score, candidates = self.__match__(ts)
 
+        res = []
+        acc = 0
+        for i in range(int(len(ts))):
+            if (best[i] is not None and score[i] >= self.CTX["MATCH_THRESHOLD"]):
+                res.append(best[i])
+            else:
+                res.append(UNKNOWN)
+
+            print("pred : ", res[-1], " true : ", y[i], " similarity : ", score[i], "matches count:", candidates[i])
+            acc += res[-1] == y[i]
+
+        print("elapsed time : ", time.time() - start)
+        print()
+
+        return acc / len(res), res
+
+    def query(self, x) -> "tuple[list[str], np.int64_1d, list[str], np.int64_1d]":
+        """
+        Find the best match and the runner-up of each trajectory of the batch,
+        with their number of matching windows (None when there is no match)
+        """
+        labels, offsets = self.__fingerprint_batch__(x)
+        ts = [labels[offsets[s]:offsets[s+1]] for s in range(len(x))]
+        return self.__match__(ts)[:4]
+
+
+    def __match__(self, ts:"list[np.int8_1d]") -> """tuple[
+            list[str], np.int64_1d, list[str], np.int64_1d, np.int64_1d]""":
+        """
+        Hash all the query windows, then look them up PROBE_CHUNK windows at a time.
+        A file scores the number of windows matching it at the same time offset
+        (stored window - query window), the best offset is kept for each file.
+        The votes are updated chunk by chunk, and a query stops probing as soon as one file clearly wins.
+        Returns the best match, its score, the runner-up, its score and the number of candidates
+        """
+        n = len(ts)
+        keys, samples, windows = hashing.batch_keys(ts, self.CTX)
+        nb_windows = (np.max(windows) + 1) if (len(windows) > 0) else 0
+        nb_files = max(len(self.index.names), 1)
+
+        # sorted (sample, file, offset) keys -> votes, and sorted (sample, file) keys -> votes of its best offset
+        votes, vote_counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        file_votes, file_counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        best, score = np.full(n, -1, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        runner_up, runner_up_score = np.full(n, -1, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        candidates = np.zeros(n, dtype=np.int64)
+
+        # keys sorted by window once : each chunk is a slice
+        order = np.argsort(windows, kind="stable")
+        keys, samples, windows = keys[order], samples[order], windows[order]
+        chunks = np.searchsorted(windows, np.arange(0, nb_windows + self.CTX["PROBE_CHUNK"], self.CTX["PROBE_CHUNK"]))
+
+        active = np.ones(n, dtype=bool)
+        for c in range(len(chunks) - 1):
+            lo, hi = chunks[c], chunks[c+1]
+            probe = active[samples[lo:hi]]
+            files, stored = self.index.lookup(keys[lo:hi][probe])
+            found = files >= 0
+
+            # a query window matching a stored window through several keys counts once
+            # (the windows of a chunk are not probed again : deduplicating the chunk is enough)
+            p_samples, p_windows = samples[lo:hi][probe][found], windows[lo:hi][probe][found]
+            pairs = np.unique(np.stack([p_samples, p_windows, files[found], stored[found] - p_windows], axis=1), axis=0)
+            if (len(pairs) == 0):
+                continue
+
+            # votes of the chunk, added to the previous ones
+            chunk, counts = np.unique(__vote_keys__(pairs[:, 0] * nb_files + pairs[:, 2], pairs[:, 3]),
+                                      return_counts=True)
+            votes, vote_counts = __accumulate__(votes, vote_counts, chunk, counts, np.add)
+            counts = vote_counts[np.searchsorted(votes, chunk)]
+
+            # best offset of each (sample, file) : the keys of a same (sample, file) are contiguous
+            pairs = chunk >> 32
+            first = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+            file_votes, file_counts = __accumulate__(file_votes, file_counts,
+                pairs[first], np.maximum.reduceat(counts, first), np.maximum)
+
+            # two best files of the updated samples (the lowest file id wins ties)
+            updated = np.unique(pairs[first] // nb_files)
+            lo = np.searchsorted(file_votes, updated * nb_files)
+            hi = np.searchsorted(file_votes, (updated + 1) * nb_files)
+            positions, group = __expand__(lo, hi - lo)
+            order = np.lexsort((file_votes[positions] % nb_files, -file_counts[positions], group))
+            positions = positions[order]
+            top = np.cumsum(hi - lo) - (hi - lo)
+            second = updated[hi - lo >= 2]
+
+            candidates[updated] = hi - lo
+            best[updated], score[updated] = file_votes[positions[top]] % nb_files, file_counts[positions[top]]
+            top = top[hi - lo >= 2] + 1
+            runner_up[second], runner_up_score[second] = file_votes[positions[top]] % nb_files, file_counts[positions[top]]
+
+            decided = (score >= self.CTX["MATCH_THRESHOLD"]) & (score >= self.CTX["MATCH_MARGIN"] * runner_up_score)
+            active &= ~decided
+            if not(np.any(active)):
+                break
+
+        names = lambda ids: [self.index.names[i] if (i >= 0) else None for i in ids.tolist()]
+        return names(best), score, names(runner_up), runner_up_score, candidates
+
+
+    def training_step(self, x, y):
+        """
+        Fit the model, add new data !
+        """
+        prntC(C.INFO, "Hashing : ")
+        hash_count = self.add_flights(x, y)
+
+        lens = [len(self.ts[f]) for f in self.ts]
+        mean = sum(lens) / len(lens)
+        prntC(C.INFO, "Mean length : ", C.BLUE, mean)
+        prntC(C.INFO, "Max length : ", C.BLUE, max(lens), "\n")
+
+        prntC(C.INFO, "Hash count : ", C.BLUE, hash_count)
+        prntC(C.INFO, "Collisions : ", C.BLUE, self.index.collisions, C.RESET, "/", C.BLUE, len(self.index))
+        prntC()
+        return 0, 0
+
+# |====================================================================================================================
+# |    STREAMING
+# |====================================================================================================================
+
+    def new_stream(self) -> hashing.RollingFingerprint:
+        """
+        Create the rolling state of a new live trajectory
+        """
+        return hashing.RollingFingerprint(self.CTX)
+
+
+    def stream(self, fp:hashing.RollingFingerprint, lat:float, lon:float, timestamp:float=None) -> str:
+        """
+        Add the next position of a live trajectory, probe the index with its last window
+        and update its votes. Costs O(1) plus a single lookup of at most HASH_SEGMENTS keys.
+        The missing seconds before the message are NaN points, as in the stored flights :
+        only the first HISTORY+2 ones can change the window, the others are skipped at once.
+        Return the replayed flight, or UNKNOWN
+        """
+        missing = fp.gap(timestamp)
+        padded = min(missing, self.CTX["HISTORY"] + 2)
+        for _ in range(padded):
+            self.__probe__(fp, np.nan, np.nan)
+        if (missing > padded):
+            fp.skip(missing - padded)
+        if (missing >= 0):
+            self.__probe__(fp, lat, lon)
+
+        if (fp.score >= self.CTX["MATCH_THRESHOLD"]):
+            return fp.match
+        return UNKNOWN
+
+
+    def __probe__(self, fp:hashing.RollingFingerprint, lat:float, lon:float) -> None:
+        if not(fp.add(lat, lon)):
+            return
+
+        keys, valid = fp.keys()
+        files, stored = self.index.lookup(keys[valid])
+        found = files >= 0
+
+        # a window matching a stored window through several keys counts once
+        for file, w in set(zip(files[found].tolist(), stored[found].tolist())):
+            vote = (self.index.names[file], w - fp.window)
+            count = fp.votes.get(vote, 0) + 1
+            fp.votes[vote] = count
+            if (count > fp.score):
+                fp.match, fp.score = vote[0], count
+
+
+# |====================================================================================================================
+# |    DIAGNOSTICS
+# |====================================================================================================================
 
+    def plot_hashed_timeseries(self, ts:"list[np.int8_1d]", y:"list[str]", path:str) -> None:
+        """
+        Save a picture of the query fingerprints, each one followed by
+        the stored fingerprint of its true flight (if known).
+        Slow : only called by compute_loss when PLOT_HASHED_TIMESERIES is set
+        """
         # plot ts
         plt_ts = []
         plot_labels = []
@@ -111,7 +287,7 @@ class Model(AbstactModel):
 
         import matplotlib.pyplot as plt
         # on each line, plot dot with color corresponding to the hash
-        colors = {"L":"#e74c3c", "R":"#3498db", "N":"#2ecc71"}
+        colors = {hashing.L:"#e74c3c", hashing.R:"#3498db", hashing.N:"#2ecc71"}
         fig, ax = plt.subplots(figsize=(20, len(plt_ts)/max_len*20))
         for i in range(len(plt_ts)):
             for j in range(len(plt_ts[i])):
@@ -132,178 +308,130 @@ class Model(AbstactModel):
         ax.invert_yaxis()
 
         plt.title("Hashed timeseries")
-        plt.savefig(self.ARTIFACTS+"/hashed_timeseries.png",bbox_inches='tight', dpi=300)
+        plt.savefig(path,bbox_inches='tight', dpi=300)
         plt.clf()
 
 
-        # compute hashes for each timeseries
-        res = []
-        acc = 0
-        for i in range(int(len(ts))):
+# |====================================================================================================================
+# |    INCREMENTAL DATABASE
+# |====================================================================================================================
 
-            hashes = []
-            for j in range(len(ts[i]) - self.CTX["HISTORY"] + 1):
-                sub_fp = hashing.sub_fp(ts[i][j:j+self.CTX["HISTORY"]])
-
-                for k in range(len(sub_fp)):
-                    hashes.append(hashing.compute_hash(sub_fp[k]))
-
-            # find matches
-            matches = []
-            for hash in hashes:
-                get = self.hashes.get(hash, [])
-
-                for match in get:
-                    matches.append(match)
-
-            # occ
-            occ = {}
-            for match in matches:
-                occ[match[0]] = occ.get(match[0], 0) + 1
-
-            # sort
-            occ = list(occ.items())
-            occ.sort(key=lambda x: x[1], reverse=True)
-
-            # print the 3 bests with their occurence
-            # print("Best matches : ", occ[:3])
-            if (len(occ) > 0):
-                if (occ[0][1] >= 20):
-                    res.append(occ[0][0])
-                else:
-                    res.append("Unknown-flight")
-            else:
-                res.append("Unknown-flight")
+    def __fingerprint_batch__(self, x) -> "tuple[np.int8_1d, np.int64_1d]":
+        """
+        Serialize and fingerprint a batch of trajectories.
+        The fingerprint of the i-th trajectory is labels[offsets[i]:offsets[i+1]]
+        """
+        serialized_x, serialized_y, offsets = hashing.serialize_lat_lon_batch(
+            [FG.lat(sample) for sample in x], [FG.lon(sample) for sample in x], self.CTX)
 
-            print("pred : ", res[-1], " true : ", y[i], " similarity : ", occ[0][1] if len(occ) > 0 else 0, "matches count:", len(occ))
-            acc += res[-1] == y[i]
+        d = np.sqrt(serialized_x**2 + serialized_y**2)
+        serialized_x[d > 0.0001] = 0
+        serialized_y[d > 0.0001] = 0
 
-        print("elapsed time : ", time.time() - start)
-        print()
+        labels = hashing.make_fingerprint(serialized_x, serialized_y, self.CTX)
+        return labels, offsets
 
-        return acc / len(res), res
 
-    def training_step(self, x, y):
+    def __fingerprints__(self, x, y) -> "dict[str, np.int8_1d]":
         """
-        Fit the model, add new data !
+        Fingerprint a batch of trajectories.
+        Samples sharing the same name are concatenated
         """
+        labels, offsets = self.__fingerprint_batch__(x)
 
+        fps = {}
+        for s in range(len(y)):
+            fps.setdefault(y[s], []).append(labels[offsets[s]:offsets[s+1]])
+        return {file:np.concatenate(fps[file]) for file in fps}
 
-        prntC(C.INFO, "Serializing data :")
-        BAR.reset(max=len(x))
 
-        serialized_x = np.zeros((0,))
-        serialized_y = np.zeros((0,))
-        files = []
+    def __flight_hashes__(self, fp:np.int8_1d) -> "tuple[np.int64_1d, np.int64_1d]":
+        """
+        Hashes of the interesting windows of a fingerprint
+        """
+        hashes, windows = hashing.fingerprint_keys(fp, self.CTX)
+        changes = hashing.window_changes(fp, self.CTX["HISTORY"])
+        interesting = changes[windows] >= self.MIN_CHANGE
+        return hashes[interesting], windows[interesting]
 
-        for s in range(len(x)):
-            sample = x[s]
-            match = y[s]
 
-            sx, sy = hashing.serialize_lat_lon(FG.lat(sample), FG.lon(sample), self.CTX)
+    def add_flights(self, x, y) -> int:
+        """
+        Fingerprint and hash new flights, only the given flights are hashed.
+        A flight already in the database is replaced.
+        With enough flights, the work is split by file between BUILD_WORKERS processes.
+        The index is compacted at the end, so the lookups use the sorted base.
+        Return the number of added hashes
+        """
+        workers = self.CTX["BUILD_WORKERS"]
+        if (workers == 0):
+            workers = os.cpu_count()
+        if (workers > 1 and len(set(y)) >= 2 * workers):
+            return self.__add_flights_parallel__(x, y, workers)
 
-            d = np.sqrt(sx**2 + sy**2)
-            sx[d > 0.0001] = 0
-            sy[d > 0.0001] = 0
+        new_ts = self.__fingerprints__(x, y)
+        BAR.reset(max=len(new_ts))
 
-            # concat
-            serialized_x = np.concatenate((serialized_x, sx))
-            serialized_y = np.concatenate((serialized_y, sy))
-            files += [match] * len(sx)
+        hash_count = 0
+        for fn, file in enumerate(new_ts):
+            hash_count += self.__add_fingerprint__(file, new_ts[file])
+            BAR.update(fn+1)
 
-            BAR.update(s+1)
+        self.index.compact()
+        return hash_count
 
 
-        serialized_x = np.array(serialized_x)
-        serialized_y = np.array(serialized_y)
+    def __add_fingerprint__(self, file:str, fp:np.int8_1d) -> int:
+        self.remove_flight(file)
+        self.ts[file] = fp
 
-        labels = hashing.make_fingerprint(serialized_x, serialized_y, self.CTX)
+        hashes, windows = self.__flight_hashes__(fp)
+        self.index.add(file, hashes, windows)
+        return len(hashes)
 
-        # # plot clusters
-        # import matplotlib.pyplot as plt
-        # colors = {"L":"#e74c3c", "R":"#3498db", "N":"#2ecc71"}
-        # #square figure
-        # plt.figure(figsize=(10,10))
-        # plt.scatter(serialized_x[:50000], serialized_y[:50000], c=[colors[i] for i in labels[:50000]], s=0.35)
-        # plt.title("Clusters")
-        # plt.axis('equal')
-        # plt.savefig(self.ARTIFACTS+"/clusters.png",bbox_inches='tight', dpi=300)
-        # plt.clf()
-
-
-        # remove each files that already have been fingerprinted
-        to_drop = []
-        for i in range(len(files)):
-            if (files[i] in self.ts):
-                to_drop.append(i)
-        for f in to_drop:
-            self.ts.pop(files[f], None)
-
-        # for each new file generate the fingerprint
-        for i in range(len(labels)):
-            if (files[i] not in self.ts):
-                self.ts[files[i]] = []
-
-            self.ts[files[i]].append(labels[i])
 
-        lens = [len(self.ts[f]) for f in self.ts]
-        mean = sum(lens) / len(lens)
-        prntC(C.INFO, "Mean length : ", C.BLUE, mean)
-        prntC(C.INFO, "Max length : ", C.BLUE, max(lens), "\n")
+    def __add_flights_parallel__(self, x, y, workers:int) -> int:
+        """
+        Build one shard per process (each shard gets whole files),
+        then merge the sorted shards in the index
+        """
+        shard_of = {}
+        for file in y:
+            if (file not in shard_of):
+                shard_of[file] = len(shard_of) % workers
 
-        # for each new files add new hashes
-        prntC(C.INFO, "Hashing : ")
-        BAR.reset(max=len(x))
+        shards = [[] for _ in range(workers)]
+        for s in range(len(y)):
+            shards[shard_of[y[s]]].append(s)
 
-        self.hashes = {}
-        hash_count = 0
-        fn = 0
-
-        for file in self.ts:
-            # split each file into fingerprints
-            for w in range(len(self.ts[file]) - self.CTX["HISTORY"] + 1):
-                fp = self.ts[file][w:w+self.CTX["HISTORY"]]
-
-                # check if the fingerprint is interesting
-                changes = 1
-                last = fp[0]
-                for i in range(1, len(fp)):
-                    if (fp[i] != last):
-                        changes += 1
-                        last = fp[i]
-
-                if (changes >= self.MIN_CHANGE):
-                    fps = hashing.sub_fp(fp)
-                    for f in range(len(fps)):
-                        # compute hash
-                        hash = hashing.compute_hash(fps[f])
-                        hash_count += 1
-
-                        # add hash to the list
-                        if (hash not in self.hashes):
-                            self.hashes[hash] = []
-                        self.hashes[hash].append((file, w))
-
-            fn += 1
-            BAR.update(fn)
+        # spawn on every platform (the default of Windows and macOS) : the same behaviour everywhere
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(__build_shard__,
+                [self.CTX] * workers,
+                [[x[s] for s in shard] for shard in shards],
+                [[y[s] for s in shard] for shard in shards]))
 
-        prntC(C.INFO, "Hash count : ", C.BLUE, hash_count)
+        for file in shard_of:
+            self.remove_flight(file)
 
-        # stat : count the hash that has collisions
-        collisions = 0
-        to_del = []
-        for hash in self.hashes:
-            if (len(self.hashes[hash]) > 1):
-                collisions += 1
-                to_del.append(hash)
+        self.index = HashIndex.merge([self.index] + [index for _, index, _ in results])
+        for ts, _, _ in results:
+            self.ts.update(ts)
 
-        for hash in to_del:
-            self.hashes.pop(hash, None)
+        return sum([hash_count for _, _, hash_count in results])
 
-        prntC(C.INFO, "Collisions : ", C.BLUE, collisions, C.RESET, "/", C.BLUE, len(self.hashes))
-        prntC()
-        return 0, 0
 
+    def remove_flight(self, name:str) -> bool:
+        """
+        Remove a flight and its hashes from the database
+        """
+        fp = self.ts.pop(name, None)
+        if (fp is None):
+            return False
+
+        hashes, _ = self.__flight_hashes__(fp)
+        self.index.remove(name, hashes)
+        return True
 
 
 
@@ -318,12 +446,81 @@ class Model(AbstactModel):
         """
         Return the variables of the model
         """
-        return self.hashes, self.ts
+        return self.index, self.ts
 
 
     def set_variables(self, variables):
         """
         Set the variables of the model
         """
-        self.hashes = variables[0]
+        self.index = variables[0]
         self.ts = variables[1]
+
+
+    def save(self, path:str) -> None:
+        """
+        Write the hash database in the given folder (compact format, opened with mmap).
+        The index and the fingerprints are written together in a new version of the folder,
+        published at once : a reader never mixes two saves
+        """
+        tmp = versions.new_version(path)
+        self.index.save(tmp)
+        save_fingerprints(tmp, self.ts)
+        versions.publish(path, tmp)
+
+
+    def load(self, path:str) -> None:
+        """
+        Open the hash database saved in the given folder, without loading it in RAM
+        """
+        folder = versions.latest(path)
+        if (folder is None):
+            folder = path # saved before the versions
+        self.index = HashIndex.open(folder)
+        self.ts = open_fingerprints(folder)
+
+
+# |====================================================================================================================
+# | VOTES
+# |====================================================================================================================
+
+def __vote_keys__(pairs:np.int64_1d, offsets:np.int64_1d) -> np.int64_1d:
+    """
+    Combine a (sample, file) pair id and a time offset (an int32) in a single sortable key
+    """
+    return (pairs << 32) + (offsets + 2**31)
+
+
+def __accumulate__(keys:np.int64_1d, values:np.int64_1d, new_keys:np.int64_1d, new_values:np.int64_1d,
+                   op:np.ufunc) -> "tuple[np.int64_1d, np.int64_1d]":
+    """
+    Merge sorted distinct (key, value) into sorted distinct (key, value) arrays,
+    the values of a key present in both are combined with op
+    """
+    pos = np.searchsorted(keys, new_keys)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == new_keys[found]
+    values = values.copy()
+    values[pos[found]] = op(values[pos[found]], new_values[found])
+    return np.insert(keys, pos[~found], new_keys[~found]), np.insert(values, pos[~found], new_values[~found])
+
+
+# |====================================================================================================================
+# | PARALLEL BUILD
+# |====================================================================================================================
+
+def __build_shard__(CTX:dict, x:"list[np.float64_2d[ax.time, ax.feature]]", y:"list[str]")\
+        -> "tuple[dict[str, np.int8_1d], HashIndex, int]":
+    """
+    Build the compacted index of a shard of files (run in a worker process)
+    """
+    FG.init(CTX)
+    model = Model(CTX)
+    new_ts = model.__fingerprints__(x, y)
+
+    hash_count = 0
+    for file in new_ts:
+        hash_count += model.__add_fingerprint__(file, new_ts[file])
+
+    model.index.compact()
+    return model.ts, model.index, hash_count
@@ -1,38 +1,87 @@
+import sys
+
 from _Utils.numpy import np, ax
 import D_DataLoader.Utils as U
 
 
-def serialize_lat_lon(lat, lon, CTX):
-    _x = np.cos(np.radians(lon)) * np.cos(np.radians(lat))
-    _y = np.sin(np.radians(lon)) * np.cos(np.radians(lat))
-    _z = np.sin(np.radians(lat))
-    x, y, z = _x.copy(), _y.copy(), _z.copy()
-    for t in range(0, len(lat)):
-        if (t == 0):
-            x[t], y[t], z[t] = (1, 0, 0)
+def __rotation_matrices__(lat:np.float64_1d, lon:np.float64_1d) -> np.float64_3d:
+    """
+    Compose, for each point, the z then y rotation that brings it to (1, 0, 0)
+    """
+    a, b = np.radians(-lon), np.radians(lat)
+    cos_a, sin_a = np.cos(a), np.sin(a)
+    cos_b, sin_b = np.cos(b), np.sin(b)
+    zeros, ones = np.zeros(len(lat)), np.ones(len(lat))
+
+    z_rot = np.stack([
+        np.stack([cos_a, -sin_a, zeros], axis=-1),
+        np.stack([sin_a,  cos_a, zeros], axis=-1),
+        np.stack([zeros,  zeros,  ones], axis=-1)], axis=1)
+    y_rot = np.stack([
+        np.stack([ cos_b, zeros, sin_b], axis=-1),
+        np.stack([ zeros,  ones, zeros], axis=-1),
+        np.stack([-sin_b, zeros, cos_b], axis=-1)], axis=1)
+
+    return np.einsum("nij,njk->nik", y_rot, z_rot)
+
+
+def serialize_lat_lon_batch(lats:"list[np.float64_1d]", lons:"list[np.float64_1d]", CTX:dict) -> """tuple[
+        np.float64_1d, np.float64_1d, np.int64_1d]""":
+    """
+    Serialize a list of trajectories at once.
+    Each point is expressed in the frame of its predecessor, the frame being
+    rolled so that the point before the predecessor lies behind the aircraft.
+
+    Returns the concatenated x, y and the offsets array :
+    the output of the i-th trajectory is x[offsets[i]:offsets[i+1]]
+    """
+    lengths = np.array([len(lat) for lat in lats], dtype=np.int64)
+    sizes = np.maximum(lengths - 1, 0)
+    offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+
+    if (offsets[-1] == 0):
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64), offsets
 
-        x[t], y[t], z[t] = U.z_rotation(x[t], y[t], z[t], np.radians(-lon[t-1]))
-        x[t], y[t], z[t] = U.y_rotation(x[t], y[t], z[t], np.radians(-lat[t-1]))
+    lat = np.concatenate([np.asarray(l, dtype=np.float64) for l in lats])
+    lon = np.concatenate([np.asarray(l, dtype=np.float64) for l in lons])
+    points = np.stack(U.spherical_to_cartesian(lat, lon), axis=-1)
 
-        if (t >= 2):
-            lx, ly, lz = _x[t-2], _y[t-2], _z[t-2]
-            lx, ly, lz = U.z_rotation(lx, ly, lz, np.radians(-lon[t-1]))
-            lx, ly, lz = U.y_rotation(lx, ly, lz, np.radians(-lat[t-1]))
-            R = -np.arctan2(-lz, -ly)
+    # global index of each serialized point, and its rank inside its own trajectory
+    starts = np.cumsum(lengths) - lengths
+    rank = np.arange(offsets[-1]) - np.repeat(offsets[:-1], sizes) + 1
+    t = np.repeat(starts, sizes) + rank
 
-        else:
-            R = -np.arctan2(z[t], y[t])
+    # rotate each point in the frame of the previous one
+    rot = __rotation_matrices__(lat[t-1], lon[t-1])
+    p = np.einsum("nij,nj->ni", rot, points[t])
 
-        x[t], y[t], z[t] = U.x_rotation(x[t], y[t], z[t], -R)
+    # roll angle from the point before the previous one (or from the point itself at the start)
+    last = np.einsum("nij,nj->ni", rot, points[np.maximum(t-2, 0)])
+    has_last = rank >= 2
+    R = np.where(has_last, -np.arctan2(-last[:, 2], -last[:, 1]), -np.arctan2(p[:, 2], p[:, 1]))
 
-    x = y
-    y = z
-    return x[1:], y[1:]
+    # x rotation of angle -R
+    cos_r, sin_r = np.cos(R), np.sin(R)
+    x = p[:, 1] * cos_r - p[:, 2] * sin_r
+    y = p[:, 1] * sin_r + p[:, 2] * cos_r
+    return x, y, offsets
 
-def make_fingerprint(x, y, CTX):
+
+# |====================================================================================================================
+# | FINGERPRINT
+# |====================================================================================================================
+
+# fingerprint values (base 3 digits of the hash)
+N = 0  # neutral (cannot be determined)
+L = 1  # left turn
+R = -1 # right turn
+
+
+def make_fingerprint(x:np.float64_1d, y:np.float64_1d, CTX:dict) -> np.int8_1d:
     """
     Compute the fingerprint of a trajectory
-    fingerprint is a string of L, R, N
+    fingerprint is an int8 array of L, R, N
     - L : left turn
     - R : right turn
     - N : netral (cannot be determined)
@@ -43,58 +92,279 @@ def make_fingerprint(x, y, CTX):
 
     MARGIN = 0.002
 
-    res = ""
-    for i in range(len(x)):
-        if (d[i] < 0.000001):
-            res+="N"
+    determined = ~(d < 0.000001)
+    fp = np.full(len(x), N, dtype=np.int8)
+    fp[determined & (a < -MARGIN) & (a > -np.pi + MARGIN)] = L
+    fp[determined & (a > MARGIN) & (a < np.pi - MARGIN)] = R
+    return fp
+
+
+# |====================================================================================================================
+# | HASHING
+# |====================================================================================================================
+
+
+def __rolling_hashes__(fp:np.int8_1d, length:int) -> np.int64_1d:
+    """
+    Signed base 3 hash of every window fp[..., w:w+length], computed in a single pass.
+    The hash is rolled from one window to the next :
+    the outgoing digit is removed, the others are shifted and the incoming digit is added.
+    """
+    nb_windows = fp.shape[-1] - length + 1
+    if (nb_windows <= 0):
+        return np.zeros(fp.shape[:-1] + (0,), dtype=np.int64)
+
+    v = fp.astype(np.int64)
+    top = 3 ** (length - 1)
+    hashes = np.zeros(fp.shape[:-1] + (nb_windows,), dtype=np.int64)
+
+    h = np.dot(v[..., :length], 3 ** np.arange(length, dtype=np.int64))
+    hashes[..., 0] = h
+    for w in range(1, nb_windows):
+        h = (h - v[..., w-1]) // 3 + v[..., w+length-1] * top
+        hashes[..., w] = h
+
+    return hashes
+
+
+def window_changes(fp:np.int8_1d, length:int) -> np.int64_1d:
+    """
+    Count the number of constant segments in every window fp[..., w:w+length]
+    """
+    n = fp.shape[-1]
+    if (n < length):
+        return np.zeros(fp.shape[:-1] + (0,), dtype=np.int64)
+    changes = np.zeros(fp.shape, dtype=np.int64)
+    changes[..., 1:] = np.cumsum(fp[..., 1:] != fp[..., :-1], axis=-1)
+    return 1 + changes[..., length-1:] - changes[..., :n-length+1]
+
+
+def window_wildcards(fp:np.int8_1d, length:int) -> np.int64_1d:
+    """
+    Count the number of N in every window fp[..., w:w+length]
+    """
+    n = fp.shape[-1]
+    if (n < length):
+        return np.zeros(fp.shape[:-1] + (0,), dtype=np.int64)
+    count = np.zeros(fp.shape[:-1] + (n + 1,), dtype=np.int64)
+    count[..., 1:] = np.cumsum(fp == N, axis=-1)
+    return count[..., length:] - count[..., :n-length+1]
+
+
+# |====================================================================================================================
+# | WILDCARD AWARE KEYS
+# |====================================================================================================================
+
+
+def segments(length:int, nb_segments:int) -> "list[tuple[int, int]]":
+    """
+    Split a window of the given length into (start, length) segments
+    """
+    bounds = np.linspace(0, length, nb_segments + 1).astype(int)
+    return [(int(bounds[j]), int(bounds[j+1] - bounds[j])) for j in range(nb_segments)]
+
+
+def window_keys(fp:np.int8_1d, CTX:dict) -> "tuple[np.int64_2d, np.bool_2d]":
+    """
+    Compute the probe keys of every window fp[..., w:w+HISTORY].
+
+    The window is split into HASH_SEGMENTS segments, the j-th key is the hash of the window
+    where the j-th segment is masked (its digits set to N = 0).
+    A key is valid only if all the N of the window lie in its masked segment.
+    Two windows share a key when they are equal outside a segment holding all their N,
+    so N behaves as a wildcard without enumerating the R/L variants.
 
-        else:
-            if (a[i] < -MARGIN and a[i] > -np.pi + MARGIN):
-                res += "L"
-            elif (a[i] > MARGIN and a[i] < np.pi - MARGIN):
-                res += "R"
+    Returns the keys and their validity, shape : [..., window, segment]
+    """
+    length, nb_segments = CTX["HISTORY"], CTX["HASH_SEGMENTS"]
+    nb_windows = fp.shape[-1] - length + 1
+    if (nb_windows <= 0):
+        shape = fp.shape[:-1] + (0, nb_segments)
+        return np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=bool)
+
+    # hash and wildcards count of each segment, for each window
+    seg_hashes, seg_wildcards = [], []
+    rolled = {}
+    for start, seg_len in segments(length, nb_segments):
+        if (seg_len not in rolled):
+            rolled[seg_len] = (__rolling_hashes__(fp, seg_len), window_wildcards(fp, seg_len))
+        hashes, wildcards = rolled[seg_len]
+        seg_hashes.append(hashes[..., start:start+nb_windows] * 3**start)
+        seg_wildcards.append(wildcards[..., start:start+nb_windows])
+
+    seg_hashes = np.stack(seg_hashes, axis=-1)
+    seg_wildcards = np.stack(seg_wildcards, axis=-1)
+    hashes = np.sum(seg_hashes, axis=-1, keepdims=True)
+    wildcards = np.sum(seg_wildcards, axis=-1, keepdims=True)
+
+    keys = np.abs(hashes - seg_hashes) * nb_segments + np.arange(nb_segments)
+    valid = (wildcards - seg_wildcards == 0) & (wildcards <= CTX["WHILDCARD_LIMIT"])
+    return keys, valid
+
+
+def fingerprint_keys(fp:np.int8_1d, CTX:dict) -> "tuple[np.int64_1d, np.int64_1d]":
+    """
+    List the valid probe keys of every window of a fingerprint
+
+    Returns the keys and the window index each key comes from
+    """
+    keys, valid = window_keys(fp, CTX)
+    windows = np.repeat(np.arange(len(keys), dtype=np.int64)[:, np.newaxis], CTX["HASH_SEGMENTS"], axis=1)
+    return keys[valid], windows[valid]
+
+
+def batch_keys(fps:"list[np.int8_1d]", CTX:dict) -> "tuple[np.int64_1d, np.int64_1d, np.int64_1d]":
+    """
+    List the valid probe keys of a batch of fingerprints, flattened in one array.
+    Fingerprints of same length are hashed all at once.
+
+    Returns the keys, the sample and the window index each key comes from
+    """
+    if (len(fps) > 0 and len({len(fp) for fp in fps}) == 1):
+        keys, valid = window_keys(np.stack(fps), CTX)
+        samples, windows, _ = np.nonzero(valid)
+        return keys[valid], samples.astype(np.int64), windows.astype(np.int64)
+
+    keys, samples, windows = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for s in range(len(fps)):
+        k, w = fingerprint_keys(fps[s], CTX)
+        keys.append(k)
+        samples.append(np.full(len(k), s, dtype=np.int64))
+        windows.append(w)
+    return np.concatenate(keys), np.concatenate(samples), np.concatenate(windows)
+
+
+# |====================================================================================================================
+# | STREAMING
+# |====================================================================================================================
+
+class RollingFingerprint:
+    """
+    Fingerprint of a live trajectory, updated message by message in O(1).
+
+    Keeps the last three points (enough to serialize the next one), the last HISTORY
+    digits in a ring buffer and the hash and N count of each segment of the current window.
+    The keys of the window are the same as window_keys would compute on the whole fingerprint.
+    Like pad() does for the stored flights, each missing second is a NaN point (see gap).
+    """
+
+    def __init__(self, CTX:dict) -> None:
+        self.CTX = CTX
+        self.length = CTX["HISTORY"]
+        self.segments = segments(CTX["HISTORY"], CTX["HASH_SEGMENTS"])
+
+        self.lats:"list[float]" = []
+        self.lons:"list[float]" = []
+        self.timestamp:float = None
+
+        self.digits = np.zeros(self.length, dtype=np.int8)
+        self.head = 0 # position of the oldest digit in the ring
+        self.count = 0 # number of digits since the start of the stream
+
+        self.seg_hashes = np.zeros(len(self.segments), dtype=np.int64)
+        self.seg_wildcards = np.zeros(len(self.segments), dtype=np.int64)
+
+        # votes of the stream, filled by the model : (file, offset) -> count
+        self.votes:"dict[tuple[str, int], int]" = {}
+        self.match:str = None
+        self.score = 0
+
+    @property
+    def window(self) -> int:
+        """
+        Index of the current window since the start of the stream
+        """
+        return self.count - self.length
+
+    def ready(self) -> bool:
+        return self.count >= self.length
+
+    @property
+    def nbytes(self) -> int:
+        # each vote : a dict entry, with its (file, offset) tuple and its count (~112 bytes)
+        return self.digits.nbytes + self.seg_hashes.nbytes + self.seg_wildcards.nbytes\
+            + sys.getsizeof(self.votes) + 112 * len(self.votes)
+
+    def gap(self, timestamp:float) -> int:
+        """
+        Number of missing seconds before a message received at the given timestamp
+        (-1 for a late or duplicated message, that must be dropped)
+        """
+        if (timestamp is None or np.isnan(timestamp)):
+            return 0
+        if (self.timestamp is None):
+            self.timestamp = timestamp
+            return 0
+
+        missing = int(timestamp - self.timestamp) - 1
+        if (missing < 0):
+            return -1
+        self.timestamp = timestamp
+        return missing
+
+    def skip(self, n:int) -> None:
+        """
+        Add n more NaN points after HISTORY+2 of them : the points and the window are only N,
+        and stay the same, only the position in the stream moves
+        """
+        self.count += n
+
+    def add(self, lat:float, lon:float) -> bool:
+        """
+        Add the next position of the trajectory.
+        Return True when a complete window is available
+        """
+        self.lats = self.lats[-2:] + [lat]
+        self.lons = self.lons[-2:] + [lon]
+        if (len(self.lats) < 2):
+            return False
+
+        x, y, _ = serialize_lat_lon_batch([np.array(self.lats)], [np.array(self.lons)], self.CTX)
+        x, y = x[-1:], y[-1:]
+        d = np.sqrt(x**2 + y**2)
+        x[d > 0.0001] = 0
+        y[d > 0.0001] = 0
+
+        self.push(make_fingerprint(x, y, self.CTX)[0])
+        return self.ready()
+
+    def push(self, digit:int) -> None:
+        """
+        Append a digit to the fingerprint and roll the segment hashes
+        """
+        digit = int(digit)
+
+        if (self.count < self.length):
+            self.digits[self.count] = digit
+            self.count += 1
+            if (self.count == self.length):
+                for j, (start, seg_len) in enumerate(self.segments):
+                    seg = self.digits[start:start+seg_len].astype(np.int64)
+                    self.seg_hashes[j] = np.dot(seg, 3 ** np.arange(start, start+seg_len, dtype=np.int64))
+                    self.seg_wildcards[j] = np.sum(seg == N)
+            return
+
+        # each segment loses its first digit and gains the first digit of the next one
+        for j, (start, seg_len) in enumerate(self.segments):
+            out = int(self.digits[(self.head + start) % self.length])
+            if (start + seg_len < self.length):
+                in_ = int(self.digits[(self.head + start + seg_len) % self.length])
             else:
-                res += "N"
-    return res
-
-
-def sub_fp(fp):
-    """
-    List all the possible fingerprint variants when there is the N placeholder (same as . from regex)
-    """
-    # remplace each N by R and L variants
-    res = [""]
-    m_count = sum([1 for c in fp if c == "N"])
-    if (m_count == 0):
-        return [fp]
-    if (m_count > 5):
-        return ["N"*len(fp)]
-
-    for c in range(len(fp)):
-        if (fp[c] == "N"):
-            l = len(res)
-            res = res + res
-            for i in range(l):
-                res[i+l*0] += "R"
-                res[i+l*1] += "L"
-        else:
-            for i in range(len(res)):
-                res[i] += fp[c]
-    return res
-
-
-def compute_hash(fp):
-    """
-    Compute the hash of a fingerprint
-    """
-    hash = 0
-    for i in range(len(fp)):
-        v = 0
-        if (fp[i] == "L"):
-            v = 1
-        elif (fp[i] == "R"):
-            v= -1
-
-        hash += v * (3 ** i)
-    hash = abs(hash)
-    return hash
\ No newline at end of file
+                in_ = digit
+
+            self.seg_hashes[j] = (int(self.seg_hashes[j]) - out * 3**start) // 3 + in_ * 3**(start + seg_len - 1)
+            self.seg_wildcards[j] += int(in_ == N) - int(out == N)
+
+        self.digits[self.head] = digit
+        self.head = (self.head + 1) % self.length
+        self.count += 1
+
+    def keys(self) -> "tuple[np.int64_1d, np.bool_1d]":
+        """
+        Probe keys of the current window, and their validity
+        """
+        nb_segments = len(self.segments)
+        hashes, wildcards = np.sum(self.seg_hashes), np.sum(self.seg_wildcards)
+        keys = np.abs(hashes - self.seg_hashes) * nb_segments + np.arange(nb_segments)
+        valid = (wildcards - self.seg_wildcards == 0) & (wildcards <= self.CTX["WHILDCARD_LIMIT"])
+        return keys, valid
@@ -0,0 +1,323 @@
+from _Utils.numpy import np, ax
+from _Utils.os_wrapper import os
+
+
+# |====================================================================================================================
+# | CONSTANTS
+# |====================================================================================================================
+
+# file id of a hash shared by several windows
+COLLIDED = -1
+# file id of a hash absent from the index
+MISSING = -2
+
+
+# |====================================================================================================================
+# | UTILS
+# |====================================================================================================================
+
+def __sort_postings__(keys:np.ndarray, files:np.int32_1d, windows:np.int32_1d) -> """tuple[
+        np.ndarray, np.int64_1d, np.int32_1d, np.int32_1d]""":
+    """
+    Group the postings by hash : return the sorted distinct hashes, and the postings
+    sorted by hash, those of the i-th hash being [starts[i], starts[i+1][
+    """
+    keys = keys.astype(np.uint64)
+    order = np.argsort(keys, kind="stable")
+    keys, files, windows = keys[order], files[order].astype(np.int32), windows[order].astype(np.int32)
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if (len(keys) > 0) else np.zeros(0, dtype=np.int64)
+    starts = np.append(first, len(keys)).astype(np.int64)
+    return keys[first], starts, files, windows
+
+
+def __expand__(starts:np.int64_1d, counts:np.int64_1d) -> "tuple[np.int64_1d, np.int64_1d]":
+    """
+    Positions of the [starts[i], starts[i]+counts[i][ ranges, and the range of each position
+    """
+    group = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return starts[group] + offsets, group
+
+
+# |====================================================================================================================
+# | HASH INDEX : hash -> (file, window) with incremental collision bookkeeping
+# |====================================================================================================================
+
+class HashIndex:
+    """
+    Append-only index of the fingerprint hashes.
+
+    Files are interned : each file name gets an integer id (its position in names).
+    The index is made of two parts :
+    - base : sorted distinct uint64 hashes, and every posting (file id, window offset) grouped by hash
+        (the postings of keys[i] are [starts[i], starts[i+1][).
+        It is the compact form saved on disk, and can be opened with mmap.
+    - delta : every posting added since the last compaction, in a dict.
+
+    Adding or removing a flight only touches the delta (removing a flight of the base
+    only marks its file id as removed, its postings are dropped by the next compaction).
+    A hash with several live postings is a collision : it is never returned by a lookup.
+    As every posting is kept, removing one of the windows sharing a hash makes the other usable again.
+    """
+
+    def __init__(self) -> None:
+        # base
+        self.keys:np.ndarray = np.zeros(0, dtype=np.uint64)
+        self.starts:np.int64_1d = np.zeros(1, dtype=np.int64)
+        self.files:np.int32_1d = np.zeros(0, dtype=np.int32)
+        self.windows:np.int32_1d = np.zeros(0, dtype=np.int32)
+
+        # interned file names
+        self.names:"list[str]" = []
+        self.name_ids:"dict[str, int]" = {}
+        self.removed:"set[int]" = set()
+
+        # delta
+        self.postings:"dict[int, list[tuple[int, int]]]" = {}
+
+    def clear(self) -> None:
+        self.__init__()
+
+# |====================================================================================================================
+# |     UPDATES
+# |====================================================================================================================
+
+    def __intern__(self, file:str) -> int:
+        id = self.name_ids.get(file, None)
+        if (id is None or id in self.removed):
+            id = len(self.names)
+            self.names.append(file)
+            self.name_ids[file] = id
+        return id
+
+    def add(self, file:str, hashes:np.int64_1d, windows:np.int64_1d) -> None:
+        id = self.__intern__(file)
+        for hash, w in zip(hashes.tolist(), windows.tolist()):
+            entries = self.postings.get(hash, None)
+            if (entries is None):
+                self.postings[hash] = [(id, w)]
+            else:
+                entries.append((id, w))
+
+    def remove(self, file:str, hashes:np.int64_1d) -> None:
+        id = self.name_ids.get(file, None)
+        if (id is None):
+            return
+        self.removed.add(id)
+
+        for hash in set(hashes.tolist()):
+            entries = self.postings.get(hash, None)
+            if (entries is None):
+                continue
+
+            entries[:] = [e for e in entries if e[0] != id]
+            if (len(entries) == 0):
+                self.postings.pop(hash)
+
+# |====================================================================================================================
+# |     LOOKUP
+# |====================================================================================================================
+
+    def __postings__(self, hashes:np.int64_1d) -> "tuple[np.int64_1d, np.int64_1d, np.int64_1d]":
+        """
+        Number of live postings of each hash, with the file id and window offset
+        of its posting when it has exactly one
+        """
+        hashes = np.asarray(hashes, dtype=np.int64)
+        files = np.full(len(hashes), MISSING, dtype=np.int64)
+        windows = np.full(len(hashes), MISSING, dtype=np.int64)
+        counts = np.zeros(len(hashes), dtype=np.int64)
+
+        # base : one searchsorted for all the hashes
+        if (len(self.keys) > 0):
+            i = np.searchsorted(self.keys, hashes.astype(np.uint64))
+            i = np.minimum(i, len(self.keys) - 1)
+            found = np.flatnonzero(self.keys[i] == hashes.astype(np.uint64))
+            starts = self.starts[i[found]]
+            counts[found] = self.starts[i[found] + 1] - starts
+            files[found], windows[found] = self.files[starts], self.windows[starts]
+
+            # postings of removed files no longer count
+            if (len(self.removed) > 0):
+                positions, group = __expand__(starts, counts[found])
+                alive = ~np.isin(self.files[positions], list(self.removed))
+                counts[found] = np.bincount(group, alive, minlength=len(found)).astype(np.int64)
+                n, p = found[group[alive]], positions[alive]
+                files[n], windows[n] = self.files[p], self.windows[p]
+                files[counts == 0], windows[counts == 0] = MISSING, MISSING
+
+        # delta : usually small, merged hash by hash
+        if (len(self.postings) > 0):
+            for n, hash in enumerate(hashes.tolist()):
+                entries = self.postings.get(hash, None)
+                if (entries is None):
+                    continue
+                if (counts[n] == 0):
+                    files[n], windows[n] = entries[0]
+                counts[n] += len(entries)
+
+        return counts, files, windows
+
+    def lookup(self, hashes:np.int64_1d) -> "tuple[np.int64_1d, np.int64_1d]":
+        """
+        Bulk lookup of many hashes at once.
+        Return the file id and window offset of each hash,
+        the file id is negative (COLLIDED or MISSING) when there is no usable match
+        """
+        counts, files, windows = self.__postings__(hashes)
+        files[counts > 1], windows[counts > 1] = COLLIDED, COLLIDED
+        return files, windows
+
+    def __hashes__(self) -> np.int64_1d:
+        """
+        Every distinct hash of the base and of the delta
+        """
+        delta = np.array(list(self.postings.keys()), dtype=np.int64)
+        return np.union1d(np.asarray(self.keys).astype(np.int64), delta)
+
+    @property
+    def collisions(self) -> int:
+        """
+        Number of hashes shared by several windows
+        """
+        counts, _, _ = self.__postings__(self.__hashes__())
+        return int(np.sum(counts > 1))
+
+    def __len__(self) -> int:
+        """
+        Number of usable (collision free) hashes
+        """
+        files, _ = self.lookup(self.__hashes__())
+        return int(np.sum(files >= 0))
+
+# |====================================================================================================================
+# |     COMPACTION
+# |====================================================================================================================
+
+    def compact(self) -> None:
+        """
+        Merge the delta into the base, and drop the postings of the removed files
+        """
+        if (len(self.postings) == 0 and len(self.removed) == 0):
+            return
+
+        # re-intern the files still alive
+        alive = [i for i in range(len(self.names)) if i not in self.removed]
+        names = [self.names[i] for i in alive]
+        remap = np.full(len(self.names) + 1, COLLIDED, dtype=np.int32)
+        remap[alive] = np.arange(len(names), dtype=np.int32)
+
+        counts = np.diff(self.starts)
+        live = (self.files == COLLIDED) | (remap[self.files] != COLLIDED)
+        keys = [np.repeat(self.keys, counts)[live]]
+        files, windows = [remap[self.files[live]]], [self.windows[live]]
+
+        # flatten the delta
+        d_keys, d_files, d_windows = [], [], []
+        for hash, entries in self.postings.items():
+            for id, w in entries:
+                d_keys.append(hash)
+                d_files.append(id)
+                d_windows.append(w)
+        keys.append(np.array(d_keys, dtype=np.uint64))
+        files.append(remap[np.array(d_files, dtype=np.int32)])
+        windows.append(np.array(d_windows, dtype=np.int32))
+
+        self.keys, self.starts, self.files, self.windows = __sort_postings__(
+            np.concatenate(keys), np.concatenate(files), np.concatenate(windows))
+        self.names, self.name_ids = names, {names[i]:i for i in range(len(names))}
+        self.removed = set()
+        self.postings = {}
+
+    @staticmethod
+    def merge(indexes:"list[HashIndex]") -> "HashIndex":
+        """
+        Merge indexes built on disjoint sets of files (e.g. shards built in parallel).
+        A hash present in several of them is a collision, as if they had been built at once
+        """
+        keys, files, windows, names = [], [], [], []
+        for index in indexes:
+            index.compact()
+            shift = np.where(index.files == COLLIDED, 0, len(names)).astype(np.int32)
+            keys.append(np.repeat(index.keys, np.diff(index.starts)))
+            files.append(index.files + shift)
+            windows.append(index.windows)
+            names += index.names
+
+        merged = HashIndex()
+        if (len(indexes) > 0):
+            merged.keys, merged.starts, merged.files, merged.windows = __sort_postings__(
+                np.concatenate(keys), np.concatenate(files), np.concatenate(windows))
+        merged.names, merged.name_ids = names, {names[i]:i for i in range(len(names))}
+        return merged
+
+# |====================================================================================================================
+# |     SAVE & OPEN (memory mapped)
+# |====================================================================================================================
+
+    def save(self, path:str) -> None:
+        """
+        Compact the index and write it in the given folder.
+        The folder must be a new one (e.g. a version of _Utils.versions) :
+        the files of a saved index may be memory mapped and are never overwritten
+        """
+        self.compact()
+        if not(os.path.exists(path)):
+            os.makedirs(path)
+
+        np.save(os.path.join(path, "keys.npy"), self.keys)
+        np.save(os.path.join(path, "starts.npy"), self.starts)
+        np.save(os.path.join(path, "files.npy"), self.files)
+        np.save(os.path.join(path, "windows.npy"), self.windows)
+        np.save(os.path.join(path, "names.npy"), np.array(self.names, dtype=str))
+
+    @staticmethod
+    def open(path:str) -> "HashIndex":
+        """
+        Open a saved index, the arrays are memory mapped and shared
+        between the processes opening the same file
+        """
+        index = HashIndex()
+        index.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        index.starts = np.arange(len(index.keys) + 1, dtype=np.int64) # saved with a posting per hash
+        if (os.path.exists(os.path.join(path, "starts.npy"))):
+            index.starts = np.load(os.path.join(path, "starts.npy"), mmap_mode="r")
+        index.files = np.load(os.path.join(path, "files.npy"), mmap_mode="r")
+        index.windows = np.load(os.path.join(path, "windows.npy"), mmap_mode="r")
+        index.names = np.load(os.path.join(path, "names.npy")).tolist()
+        index.name_ids = {index.names[i]:i for i in range(len(index.names))}
+        return index
+
+
+# |====================================================================================================================
+# | FINGERPRINTS STORAGE
+# |====================================================================================================================
+
+def save_fingerprints(path:str, ts:"dict[str, np.int8_1d]") -> None:
+    """
+    Write all the fingerprints as one int8 array with an offsets array
+    (in a new folder, as HashIndex.save)
+    """
+    if not(os.path.exists(path)):
+        os.makedirs(path)
+
+    names = list(ts.keys())
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ts[name]) for name in names])
+    fingerprints = np.zeros(0, dtype=np.int8)
+    if (len(names) > 0):
+        fingerprints = np.concatenate([ts[name] for name in names]).astype(np.int8)
+
+    np.save(os.path.join(path, "fingerprints.npy"), fingerprints)
+    np.save(os.path.join(path, "fp_offsets.npy"), offsets)
+    np.save(os.path.join(path, "fp_names.npy"), np.array(names, dtype=str))
+
+
+def open_fingerprints(path:str) -> "dict[str, np.int8_1d]":
+    """
+    Open the saved fingerprints, each one is a view on the memory mapped array
+    """
+    fingerprints = np.load(os.path.join(path, "fingerprints.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(path, "fp_offsets.npy"))
+    names = np.load(os.path.join(path, "fp_names.npy")).tolist()
+    return {names[i]:fingerprints[offsets[i]:offsets[i+1]] for i in range(len(names))}
@@ -61,3 +61,6 @@ ADD_MAP_CONTEXT = False
 INPUT_PADDING = "valid"
 
 NB_TRAIN_SAMPLES = 1
+
+# on-disk cache of the preprocessed flights, keyed by the features settings (None : no cache)
+FEATURE_CACHE = "./_Artifacts/FeatureCache/"
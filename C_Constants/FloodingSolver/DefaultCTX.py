@@ -13,3 +13,6 @@ BOX_CENTER = (
 )
 
 INPUT_PADDING = "valid"
+
+# on-disk cache of the preprocessed flights, keyed by the features settings (None : no cache)
+FEATURE_CACHE = "./_Artifacts/FeatureCache/"
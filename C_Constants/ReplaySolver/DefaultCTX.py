@@ -9,3 +9,6 @@ RANDOM_TRACK = False
 
 
 
+
+# on-disk cache of the preprocessed flights, keyed by the features settings (None : no cache)
+FEATURE_CACHE = "./_Artifacts/FeatureCache/"
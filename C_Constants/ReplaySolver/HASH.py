@@ -2,6 +2,22 @@
 EPOCHS = 1
 
 WHILDCARD_LIMIT = 5
+# number of segments a window is split into, each key masks one of them
+HASH_SEGMENTS = 4
+
+# number of windows matching a flight at the same time offset to recognize a replay
+MATCH_THRESHOLD = 10
+# a query stops probing once its best match has MATCH_MARGIN times more votes than the runner-up
+MATCH_MARGIN = 3
+# number of windows probed between two checks of the votes
+PROBE_CHUNK = 16
+
+# number of processes building the index (0 : one per core, 1 : no parallelism).
+# The workers are spawned : the script running the build must be guarded by if __name__ == "__main__"
+BUILD_WORKERS = 1
+
+# save a picture of the fingerprints of each query batch (slow, for diagnostics only)
+PLOT_HASHED_TIMESERIES = False
 
 HISTORY = 32
 INPUT_LEN = HISTORY
@@ -4,15 +4,16 @@ from _Utils.os_wrapper import os
 import _Utils.FeatureGetter as FG
 import _Utils.Color as C
 from   _Utils.Color import prntC
-from   _Utils.Scaler3D import StandardScaler3D, MinMaxScaler2D, fill_nan_3d, fill_nan_2d
+from   _Utils.Scaler3D import StandardScaler3D, MinMaxScaler2D, fill_nan_3d
 from   _Utils.SparceLabelBinarizer import SparceLabelBinarizer
 from   _Utils.ProgressBar import ProgressBar
 import _Utils.Limits as Limits
 from _Utils.plotADSB import PLT
-from   _Utils.ADSB_Streamer import Streamer
+from   _Utils.ADSB_Streamer import STREAMER
 from _Utils.numpy import np, ax
 
 import D_DataLoader.Utils as U
+from   D_DataLoader.FeatureCache import FeatureCache
 import D_DataLoader.AircraftClassification.Utils as SU
 from   D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 
@@ -22,7 +23,6 @@ from   D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 # |====================================================================================================================
 
 BAR = ProgressBar()
-STREAMER = Streamer()
 
 
 # |====================================================================================================================
@@ -69,22 +69,33 @@ class DataLoader(AbstractDataLoader):
 
         SU.resetICAOdb()
         BAR.reset(max=len(filenames))
+        cache = FeatureCache(CTX, path, CTX.get("FEATURE_CACHE", None))
 
         x, y = [], []
         for f in range(len(filenames)):
-            df = U.read_trajectory(filenames[f])
-
-            label = SU.getLabel(CTX, df["icao24", 0])
+            # on a cache hit the csv is not read at all
+            df = None
+            array, icao = cache.get(filenames[f])
+            if (icao is None):
+                df = U.read_trajectory(filenames[f])
+                icao = df["icao24", 0]
+
+            label = SU.getLabel(CTX, icao)
             if (label == 0):
+                if (df is not None): cache.put(filenames[f], None, icao)
                 continue
 
-            array = U.df_to_feature_array(CTX, df)
+            if (array is None):
+                if (df is None): df = U.read_trajectory(filenames[f])
+                array = U.df_to_feature_array(CTX, df)
+                cache.put(filenames[f], array, icao)
 
             x.append(array)
             y.append(label)
 
             if (is_folder): BAR.update(f+1)
 
+        cache.save()
         if (self.PAD is None): self.PAD = U.genPadValues(CTX, x)
         x = fill_nan_3d(x, self.PAD)
         y = self.yScaler.transform(y)
@@ -269,24 +280,27 @@ class StreamerInterface:
     def __init__(self, dl:DataLoader) -> None:
         self.dl = dl
         self.CTX = dl.CTX
+        STREAMER.require(self.CTX["HISTORY"])
+
+    def ingest(self, x:"list[dict[str, object]]") -> None:
+        """
+        Store the messages of a time tick at once (see Streamer.add_batch) :
+        stream then finds each message already stored
+        """
+        STREAMER.add_messages(x)
 
     def stream(self, x:"dict[str, object]"):
         tag = x.get("tag", x['icao24'])
 
         raw_df = STREAMER.add(x, tag=tag)
-        cache = STREAMER.cache("AircraftClassification", tag)
+        features = STREAMER.cache("AircraftClassification", tag)
 
-        array = U.df_to_feature_array(self.CTX, raw_df[-2:], check_length=False)
-        array = fill_nan_2d(array, self.dl.PAD)
-
-        # concatenate the new array to the cache
-        # remove the first element of the array
-        # as it is the last element of the previous array but unformatted
-        if (cache is not None):
-            cache = np.concatenate([cache, array[1:]], axis=0)
-        else:
-            cache = array
-        STREAMER.cache("AircraftClassification", tag, cache)
+        # the whole trajectory is kept : the take-off context needs its beginning
+        # (its size is charged to the memory budget of the streamer)
+        if (features is None):
+            features = U.IncrementalFeatures(self.CTX, self.dl.PAD)
+            STREAMER.cache("AircraftClassification", tag, features)
+        cache = features.update(raw_df)
 
         # batch assembly
         x_batch, _, x_batch_takeoff, x_batch_map, x_batch_airport =\
@@ -302,18 +316,24 @@ class StreamerInterface:
 
 
     """
-    Attach the prediction to the cache
+    Attach the prediction to the cache.
+    Only the running sum and count (ignoring nan) of the predictions are kept :
+    returns their mean, as a single row (the nanmean of all the predictions)
     """
     def predicted(self, x:"dict[str, object]", y_:np.ndarray) -> np.ndarray:
         tag = x.get("tag", x['icao24'])
         preds = STREAMER.cache("AircraftClassification_Pred", tag)
 
         if (preds is None):
-            STREAMER.cache("AircraftClassification_Pred", tag, [y_])
-            return np.array([y_])
-
-        preds.append(y_)
-        return np.array(preds)
+            preds = np.zeros((2, len(y_)), dtype=np.float64)
+            STREAMER.cache("AircraftClassification_Pred", tag, preds)
+
+        valid = ~np.isnan(y_)
+        preds[0, valid] += y_[valid]
+        preds[1, valid] += 1
+        mean = np.full(len(y_), np.nan, dtype=np.float64)
+        np.divide(preds[0], preds[1], out=mean, where=preds[1] > 0)
+        return mean[np.newaxis]
 
 
 
@@ -0,0 +1,155 @@
+import hashlib
+import json
+
+from _Utils.numpy import np, ax
+from _Utils.os_wrapper import os
+import _Utils.versions as versions
+
+
+# |====================================================================================================================
+# | CONSTANTS
+# |====================================================================================================================
+
+# CTX fields df_to_feature_array depends on
+CTX_FIELDS = ["USED_FEATURES", "INPUT_PADDING", "HISTORY"]
+# to bump when the feature extraction changes : invalidate every cache
+VERSION = 1
+
+# length of an entry whose features were never computed (only its meta is known)
+NOT_COMPUTED = -1
+
+
+# |====================================================================================================================
+# | FEATURE CACHE : flight file -> feature array, persisted between runs
+# |====================================================================================================================
+
+class FeatureCache:
+    """
+    On-disk cache of the feature arrays (df_to_feature_array) of a dataset folder.
+
+    There is one cache folder per (CTX fields, dataset folder). Each save() writes a new version
+    of the cache in a numbered subfolder (the highest one is the current one), made of :
+    - features.npy : every array concatenated on the time axis, memory mapped (copy on write)
+    - offsets.npy : start and length of each array
+    - names.npy, stamps.npy : file name, and its (mtime, size) when the entry was computed
+    - meta.npy : a string per file (e.g. its icao24)
+
+    An entry is only used if the file did not change since. New entries are kept in memory
+    until save(), which writes a new version : a version is never modified, as other processes
+    may still have it memory mapped (on Windows, it can't be deleted until they close it).
+    A None root disables the cache (every get is a miss).
+    """
+
+    def __init__(self, CTX:dict, path:str, root:str) -> None:
+        self.nb_features = len(CTX["USED_FEATURES"])
+        self.path = None
+        if (root is not None):
+            key = json.dumps([VERSION, os.path.abspath(path)] + [CTX.get(f, None) for f in CTX_FIELDS])
+            self.path = os.path.join(root, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+        self.features:np.float64_2d[ax.time, ax.feature] = np.zeros((0, self.nb_features), dtype=np.float64)
+        # name -> (start, length, mtime, size, meta)
+        self.entries:"dict[str, tuple[int, int, int, int, str]]" = {}
+        # name -> (array, mtime, size, meta)
+        self.new:"dict[str, tuple[np.float64_2d[ax.time, ax.feature], int, int, str]]" = {}
+
+        folder = versions.latest(self.path)
+        if (folder is not None):
+            self.__open__(folder)
+
+# |====================================================================================================================
+# |     LOOKUP
+# |====================================================================================================================
+
+    @staticmethod
+    def __stamp__(file:str) -> "tuple[int, int]":
+        stat = os.stat(file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, file:str) -> "tuple[np.float64_2d[ax.time, ax.feature], str]":
+        """
+        Return the cached array and meta of the file,
+        the array is None if it was never computed, the meta is None on a miss
+        """
+        if (self.path is None):
+            return None, None
+
+        entry = self.entries.get(os.path.basename(file), None)
+        if (entry is None):
+            return None, None
+        start, length, mtime, size, meta = entry
+        if ((mtime, size) != self.__stamp__(file)):
+            return None, None
+
+        if (length == NOT_COMPUTED):
+            return None, meta
+        if (length == 0):
+            return np.zeros((0, self.nb_features), dtype=np.float64), meta
+        return self.features[start:start+length], meta
+
+    def put(self, file:str, array:np.float64_2d[ax.time, ax.feature], meta:str="") -> None:
+        """
+        Add an entry, a None array only records the meta
+        """
+        if (self.path is None):
+            return
+        mtime, size = self.__stamp__(file)
+        self.new[os.path.basename(file)] = (array, mtime, size, str(meta))
+
+# |====================================================================================================================
+# |     SAVE & OPEN (memory mapped)
+# |====================================================================================================================
+
+    def save(self) -> None:
+        """
+        Merge the new entries into a new version of the cache
+        (to call before the arrays are modified in place, e.g. by fill_nan_3d)
+        """
+        if (self.path is None or len(self.new) == 0):
+            return
+
+        names, offsets, stamps, metas, arrays = [], [], [], [], []
+        start = 0
+        def append(name, array, length, mtime, size, meta):
+            nonlocal start
+            names.append(name)
+            offsets.append((start, length))
+            stamps.append((mtime, size))
+            metas.append(meta)
+            if (length > 0):
+                arrays.append(array)
+                start += length
+
+        for name, (s, length, mtime, size, meta) in self.entries.items():
+            if (name not in self.new):
+                append(name, self.features[s:s+length], length, mtime, size, meta)
+
+        for name, (array, mtime, size, meta) in self.new.items():
+            length = NOT_COMPUTED if (array is None) else len(array)
+            append(name, array, length, mtime, size, meta)
+
+        features = np.zeros((0, self.nb_features), dtype=np.float64)
+        if (len(arrays) > 0):
+            features = np.concatenate(arrays, axis=0).astype(np.float64)
+        # drop our memory map of the previous version
+        self.features = features
+
+        # write in a folder unique to this process, then publish it as the next version
+        tmp = versions.new_version(self.path)
+        np.save(os.path.join(tmp, "features.npy"), features)
+        np.save(os.path.join(tmp, "offsets.npy"), np.array(offsets, dtype=np.int64).reshape(-1, 2))
+        np.save(os.path.join(tmp, "stamps.npy"), np.array(stamps, dtype=np.int64).reshape(-1, 2))
+        np.save(os.path.join(tmp, "names.npy"), np.array(names, dtype=str))
+        np.save(os.path.join(tmp, "meta.npy"), np.array(metas, dtype=str))
+
+        self.new = {}
+        self.__open__(versions.publish(self.path, tmp))
+
+    def __open__(self, folder:str) -> None:
+        self.features = np.load(os.path.join(folder, "features.npy"), mmap_mode="c")
+        offsets = np.load(os.path.join(folder, "offsets.npy")).tolist()
+        stamps = np.load(os.path.join(folder, "stamps.npy")).tolist()
+        names = np.load(os.path.join(folder, "names.npy")).tolist()
+        metas = np.load(os.path.join(folder, "meta.npy")).tolist()
+        self.entries = {names[i]:(offsets[i][0], offsets[i][1], stamps[i][0], stamps[i][1], metas[i])
+                        for i in range(len(names))}
@@ -2,6 +2,7 @@
 import pandas as pd
 
 import D_DataLoader.Utils as U
+from   D_DataLoader.FeatureCache import FeatureCache
 import D_DataLoader.FloodingSolver.Utils as SU
 from   D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 
@@ -9,10 +10,10 @@ import _Utils.FeatureGetter as FG
 import _Utils.Color as C
 from   _Utils.Color import prntC
 from   _Utils import Limits
-from   _Utils.Scaler3D import  StandardScaler3D, SigmoidScaler2D, fill_nan_3d, fill_nan_2d
+from   _Utils.Scaler3D import  StandardScaler3D, SigmoidScaler2D, fill_nan_3d
 from   _Utils.ProgressBar import ProgressBar
 from   _Utils.plotADSB import PLT
-from   _Utils.ADSB_Streamer import Streamer
+from   _Utils.ADSB_Streamer import STREAMER
 from   _Utils.numpy import np, ax
 
 
@@ -23,7 +24,6 @@ from   _Utils.numpy import np, ax
 
 
 BAR = ProgressBar()
-STREAMER = Streamer()
 
 
 # |====================================================================================================================
@@ -70,14 +70,19 @@ class DataLoader(AbstractDataLoader):
 
         filenames = U.list_flights(path, limit=Limits.INT_MAX) #Limit.INT_MAX
         BAR.reset(max=len(filenames))
+        cache = FeatureCache(CTX, path, CTX.get("FEATURE_CACHE", None))
 
         x = []
         for f in range(len(filenames)):
-            df = U.read_trajectory(filenames[f])
-            array = U.df_to_feature_array(CTX, df)
+            array, _ = cache.get(filenames[f])
+            if (array is None):
+                df = U.read_trajectory(filenames[f])
+                array = U.df_to_feature_array(CTX, df)
+                cache.put(filenames[f], array)
             x.append(array)
             BAR.update(f+1)
 
+        cache.save()
         if (self.PAD is None): self.PAD = U.genPadValues(CTX, x)
         x = fill_nan_3d(x, self.PAD)
 
@@ -222,6 +227,14 @@ class StreamerInterface:
     def __init__(self, dl:DataLoader) -> None:
         self.dl = dl
         self.CTX = dl.CTX
+        STREAMER.require(self.CTX["HISTORY"] + self.CTX["HORIZON"])
+
+    def ingest(self, x:"list[dict[str, object]]") -> None:
+        """
+        Store the messages of a time tick at once (see Streamer.add_batch) :
+        stream then finds each message already stored
+        """
+        STREAMER.add_messages(x)
 
     def stream(self, x:"dict[str, object]") -> """tuple[
             np.float64_3d[ax.sample, ax.time, ax.feature],
@@ -233,17 +246,12 @@ class StreamerInterface:
 
         tag = x.get("tag", x["icao24"])
         raw_df = STREAMER.add(x, tag=tag)
-        cache = STREAMER.cache("FloodingSolver", tag)
-
-        array = U.df_to_feature_array(self.CTX, raw_df[-2:], check_length=False)
-        array = fill_nan_2d(array, self.dl.PAD)
+        features = STREAMER.cache("FloodingSolver", tag)
 
-        if (cache is not None):
-            cache = np.concatenate([cache, array[1:]], axis=0)
-            cache = cache[-MAX_LENGTH_NEEDED:]
-        else:
-            cache = array
-        STREAMER.cache("FloodingSolver", tag, cache)
+        if (features is None):
+            features = U.IncrementalFeatures(self.CTX, self.dl.PAD, length=MAX_LENGTH_NEEDED)
+            STREAMER.cache("FloodingSolver", tag, features)
+        cache = features.update(raw_df)
 
         # |--------------------------
         # | Generate a sample
@@ -263,6 +271,7 @@ class StreamerInterface:
 
 
     def clear(self)-> None:
-        STREAMER.clear()
+        # the streamer is shared : only drop the state of this solver
+        STREAMER.clear("FloodingSolver")
 
 
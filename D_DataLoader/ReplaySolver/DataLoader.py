@@ -9,11 +9,12 @@ import _Utils.FeatureGetter as FG
 import _Utils.Color as C
 from   _Utils.Color import prntC
 from   _Utils import Limits
-from   _Utils.Scaler3D import fill_nan_3d, fill_nan_2d
+from   _Utils.Scaler3D import fill_nan_3d
 from   _Utils.ProgressBar import ProgressBar
-from   _Utils.ADSB_Streamer import Streamer
+from   _Utils.ADSB_Streamer import STREAMER, cast_msg
 
 import D_DataLoader.Utils as U
+from   D_DataLoader.FeatureCache import FeatureCache
 import D_DataLoader.ReplaySolver.Utils as SU
 from D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 
@@ -24,7 +25,6 @@ from D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 
 
 BAR = ProgressBar()
-STREAMER = Streamer()
 
 
 TEST_SIZE = 60
@@ -52,6 +52,8 @@ class DataLoader(AbstractDataLoader):
     def __init__(self, CTX:dict, path:str="") -> None:
         self.CTX = CTX
 
+        self.streamer = StreamerInterface(self)
+
         training = (CTX["EPOCHS"] and path != "")
 
         if (training):
@@ -78,14 +80,19 @@ class DataLoader(AbstractDataLoader):
             path = "/".join(path[:-1])
 
         BAR.reset(max=len(filenames))
+        cache = FeatureCache(CTX, path, CTX.get("FEATURE_CACHE", None))
 
         x = []
         for f in range(len(filenames)):
-            df = U.read_trajectory(filenames[f])
-            array = U.df_to_feature_array(CTX, df)
+            array, _ = cache.get(filenames[f])
+            if (array is None):
+                df = U.read_trajectory(filenames[f])
+                array = U.df_to_feature_array(CTX, df)
+                cache.put(filenames[f], array)
             x.append(array)
             if (is_folder): BAR.update()
 
+        cache.save()
 
         return x, filenames
 
@@ -186,29 +193,33 @@ class StreamerInterface:
     def __init__(self, dl:DataLoader) -> None:
         self.dl = dl
         self.CTX = dl.CTX
-
-    def stream(self, x:"dict[str, object]") -> """tuple[
-            np.float64_2d[ax.time, ax.feature],
-            bool]""":
-
-        MAX_LENGTH_NEEDED = self.CTX["HISTORY"]
-
+        STREAMER.require(self.CTX["HISTORY"])
+
+    def ingest(self, x:"list[dict[str, object]]") -> None:
+        """
+        Store the messages of a time tick at once (see Streamer.add_batch) :
+        stream then finds each message already stored
+        """
+        STREAMER.add_messages(x)
+
+    def stream(self, x:"dict[str, object]") -> "tuple[str, float, float, float]":
+        """
+        Store the message, and return its tag, position and timestamp.
+        The replay detection state of each tag is kept in the streamer cache (see get/set_state)
+        """
         tag = x.get("tag", x["icao24"])
-        raw_df = STREAMER.add(x, tag=tag)
-        cache = STREAMER.getCache("ReplaySolver", tag)
+        STREAMER.add(x, tag=tag)
+        return tag, x.get("latitude", np.nan), x.get("longitude", np.nan), \
+            cast_msg("timestamp", x.get("timestamp", np.nan))
 
-        array = U.df_to_feature_array(self.CTX, raw_df[-2:], check_length=False)
-        array = fill_nan_2d(array, self.dl.PAD)
 
-        if (cache is not None):
-            cache = np.concatenate([cache, array[1:]], axis=0)
-            cache = cache[-MAX_LENGTH_NEEDED:]
-        else:
-            cache = array
-        STREAMER.cache("FloodingSolver", tag, cache)
+    def get_state(self, tag:str) -> object:
+        return STREAMER.cache("ReplaySolver", tag)
 
-        return cache, SU.check_sample(self.CTX, [cache], 0, len(cache) - 1)
+    def set_state(self, tag:str, state:object) -> None:
+        STREAMER.cache("ReplaySolver", tag, state)
 
 
     def clear(self)-> None:
-        STREAMER.clear()
+        # the streamer is shared : only drop the state of this solver
+        STREAMER.clear("ReplaySolver")
@@ -5,7 +5,7 @@ import _Utils.Color as C
 from _Utils.Color import prntC
 import _Utils.FeatureGetter as FG
 import _Utils.Limits as Limits
-from _Utils.ADSB_Streamer import Streamer
+from _Utils.ADSB_Streamer import STREAMER
 from _Utils.ProgressBar import ProgressBar
 
 import D_DataLoader.Utils as U
@@ -18,7 +18,6 @@ from D_DataLoader.AbstractDataLoader import DataLoader as AbstractDataLoader
 # |====================================================================================================================
 
 BAR = ProgressBar()
-STREAMER = Streamer()
 
 
 # |====================================================================================================================
@@ -91,35 +90,63 @@ class StreamerInterface:
 
         if (tag != icao):
             STREAMER.add(x, tag=tag)
+            # mark the trajectory as used by this solver (see clear)
+            STREAMER.cache("TrajectorySeparator", tag, True)
         else:
             prntC(C.WARNING, "No tag provided for message : ", x['icao24'])
 
 
+    def ingest(self, x:"list[dict[str, object]]") -> None:
+        """
+        Store the tagged messages of a time tick at once (see Streamer.add_batch) :
+        stream then finds each message already stored
+        """
+        STREAMER.add_messages([msg for msg in x if msg.get("tag", msg["icao24"]) != msg["icao24"]])
+
+
     def clear(self)-> None:
-        STREAMER.clear()
+        # the streamer is shared : only drop the state of this solver
+        STREAMER.clear("TrajectorySeparator")
 
 
     def get_flights_with_icao(self, icao:str, timestamp:int) -> """tuple[
         list[np.float64_2d[ax.time, ax.feature]],
         list[str]]""":
-
-        tags = STREAMER.get_tags_for_icao(icao)
-        if (len(tags) == 0):
-            return [], []
-
-        COL = self.CTX["USED_FEATURES"]
-        x, tags = zip(*[[STREAMER.get(tag).getColumns(COL), tag] for tag in tags])
-
-        # remove trajectory witch already has a message at this timestamp
-        x_tag = [(x[i], tags[i]) for i in range(len(x))
-                        if len(x[i]) <= 1 or int(x[i][-1, -1]) < timestamp]
-
-        if (len(x_tag) > 0):
-            x, tags = zip(*x_tag)
-            x, tags = list(x), list(tags)
-
-        return list(x), list(tags)
-
-
+        """
+        Trajectories of the aircrafts sharing the icao, and their tags.
+        Only the last STREAMER.capacity messages of each one are kept
+        (the models only look at the last few messages, e.g. FORECAST_LEN)
+        """
+        return self.get_flights_with_icaos([icao], [timestamp])[0]
 
 
+    def get_flights_with_icaos(self, icaos:"list[str]", timestamps:"list[int]") -> """list[tuple[
+        list[np.float64_2d[ax.time, ax.feature]],
+        list[str]]]""":
+        """
+        get_flights_with_icao for many icaos : the trajectories of all of them are gathered at once
+        """
+        per_icao = [list(STREAMER.get_tags_for_icao(icao)) for icao in icaos]
+        all_tags = [tag for tags in per_icao for tag in tags]
+        if (len(all_tags) == 0):
+            return [([], []) for _ in icaos]
+
+        windows, lens = STREAMER.windows(all_tags, STREAMER.capacity)
+        windows = windows[:, :, [STREAMER.slab.columns[col] for col in self.CTX["USED_FEATURES"]]]
+        length = windows.shape[1]
+
+        flights = []
+        first = 0
+        for tags, timestamp in zip(per_icao, timestamps):
+            x = [windows[first + i, length - lens[first + i]:] for i in range(len(tags))]
+            first += len(tags)
+
+            # remove trajectory witch already has a message at this timestamp
+            x_tag = [(x[i], tags[i]) for i in range(len(x))
+                            if len(x[i]) <= 1 or int(x[i][-1, -1]) < timestamp]
+
+            if (len(x_tag) > 0):
+                x, tags = zip(*x_tag)
+            flights.append((list(x), list(tags)))
+
+        return flights
@@ -4,7 +4,7 @@ from typing import overload
 
 import _Utils.Color as C
 from   _Utils.Color import prntC
-from   _Utils.DataFrame import DataFrame
+from   _Utils.DataFrame import DataFrame, RingDataFrame
 import _Utils.FeatureGetter as FG
 import _Utils.Limits as Limits
 from   _Utils.numpy import np, ax
@@ -117,6 +117,16 @@ def angle_diff(a:float, b:float) -> float:
     return diff
 
 
+def angle_diffs(a:np.float64_1d, b:np.float64_1d) -> np.float64_1d:
+    """
+    Vectorized angle_diff
+    """
+    diff = b % 360 - a % 360
+    diff[diff > 180] -= 360
+    diff[diff < -180] += 360
+    return diff
+
+
 # |====================================================================================================================
 # | TRAJECTORY PREPROCESSING
 # |====================================================================================================================
@@ -173,13 +183,28 @@ def get_aircraft_position(CTX:dict, flight:np.float64_2d[ax.time, ax.feature]) -
 # | Convert a CSV dataframe into a numerical array with the right features
 # |--------------------------------------------------------------------------------------------------------------------
 
+def feature_schema(CTX:dict) -> "list[str]":
+    """
+    Columns added to the raw trajectory by df_to_feature_array
+    """
+    schema = ["pad", "day", "hour", "min", "sec", "relative_track"]
+    if ("toulouse_0" in CTX["USED_FEATURES"]):
+        schema += ["toulouse_"+str(i) for i in range(len(TOULOUSE))]
+    if ("fingerprint" in CTX["USED_FEATURES"]):
+        schema.append("fingerprint")
+    return schema
+
+
 def df_to_feature_array(CTX:dict, df:DataFrame, check_length:bool=True) -> np.float64_2d[ax.time, ax.feature]:
     """
     Convert a complete ADS-B trajectory dataframe into a numpy array
     with the right features and preprocessing
     """
+    # the derived columns are allocated once, then filled in place
     if isinstance(df, pd.DataFrame):
-        df = DataFrame(df)
+        df = DataFrame(df, reserve=feature_schema(CTX))
+    else:
+        df.reserve(feature_schema(CTX))
     df = pad(df, CTX)
 
     # if no padding check there is no nan in latitude
@@ -205,10 +230,8 @@ def df_to_feature_array(CTX:dict, df:DataFrame, check_length:bool=True) -> np.fl
 
     # add relative track
     track = df["track"]
-    relative_track = track.copy()
-    for i in range(1, len(relative_track)):
-        relative_track[i] = angle_diff(track[i-1], track[i])
-    relative_track[0] = 0
+    relative_track = np.zeros(len(track), dtype=np.float64)
+    relative_track[1:] = angle_diffs(track[:-1], track[1:])
     df.add_column("relative_track", relative_track)
     df.setColumValue("timestamp", slice(0, len(df)), df["timestamp"]) # 01/01/2015
 
@@ -220,36 +243,7 @@ def df_to_feature_array(CTX:dict, df:DataFrame, check_length:bool=True) -> np.fl
             df.add_column("toulouse_"+str(i), dists[:, i])
 
     if ("fingerprint" in CTX["USED_FEATURES"]):
-        fingerprint, rot = rotation_speed(df["latitude"], df["longitude"])
-
-        test_finger = np.zeros((16, 32), dtype=np.int8)
-        sub_dfs = []
-        sub_rot = []
-        for i in range(8):
-            sub_df = rotate_df(df[0:32].copy())
-            sub_dfs.append(sub_df)
-            test_finger[i], r = rotation_speed(sub_df["latitude"], sub_df["longitude"])
-            sub_rot.append(r)
-        for i in range(8):
-            sub_df = scale_df(df[0:32].copy())
-            sub_dfs.append(sub_df)
-            test_finger[i+8], r = rotation_speed(sub_df["latitude"], sub_df["longitude"])
-            sub_rot.append(r)
-
-
-        plot_fingerprint(test_finger, sub_rot)
-
-        abnormal = [0, 3, 7, 11]
-        if (len(abnormal) > 1):
-            import matplotlib.pyplot as plt
-            fig, ax = plt.subplots(len(abnormal), 1, figsize=(10, 10*len(abnormal)))
-            for i in range(len(abnormal)):
-                ax[i].plot(sub_dfs[abnormal[i]]["latitude"], sub_dfs[abnormal[i]]["longitude"], c="tab:blue")
-                ax[i].scatter(sub_dfs[abnormal[i]]["latitude"], sub_dfs[abnormal[i]]["longitude"], c="tab:blue")
-            plt.show()
-
-
-
+        fingerprint, _ = rotation_speed(df["latitude"], df["longitude"])
         df.add_column("fingerprint", fingerprint)
 
 
@@ -273,35 +267,6 @@ def df_to_feature_array(CTX:dict, df:DataFrame, check_length:bool=True) -> np.fl
     if (len(array) == 0): return None
     return array
 
-TOULOUSE_LATS = np.array([TOULOUSE[i]['lat'] for i in range(len(TOULOUSE))], dtype=np.float64)
-TOULOUSE_LONS = np.array([TOULOUSE[i]['long'] for i in range(len(TOULOUSE))], dtype=np.float64)
-
-def toulouse_airportDistance(lats:"list[float]", lons:"list[float]"):
-    """
-    Compute the distance to the nearest airport
-    """
-    dtype_number = False
-    if (isinstance(lats, int) or isinstance(lats, float)):
-        lats = [lats]
-        lons = [lons]
-        dtype_number = True
-
-    dists = np.zeros((len(lats), len(TOULOUSE)), dtype=np.float64)
-    for i in range(len(lats)):
-        dists[i] = latlondistance(lats[i], lons[i], TOULOUSE_LATS, TOULOUSE_LONS)
-
-
-    # cap distance to 50km max
-    dists = dists / 1000
-    dists = np.clip(dists, 0, 50)
-    for i in range(len(dists)):
-        for j in range(len(dists[i])):
-            if (lats[i] == 0 and lons[i] == 0):
-                dists[i][j] = 0
-
-    if (dtype_number):
-        return dists[0]
-    return dists
 
 def pad(df:DataFrame, CTX):
     """
@@ -315,17 +280,14 @@ def pad(df:DataFrame, CTX):
 
     pad_df = np.full((int(total_length), len(df.columns)), np.nan, dtype=np.float64)
     pad_df[:, -1] = np.ones(int(total_length), dtype=np.float64)
-    for i in range(len(df)):
-        t = df["timestamp"][i]
-        pad_df[int(t - start)] = df[i]
+    pad_df[(df["timestamp"] - start).astype(np.int64)] = df.to_numpy()
     pad_df[:, 0] = np.arange(start, df["timestamp"][-1]+1)
 
     if (CTX["INPUT_PADDING"] == "last"):
-        # replace nan with last value
-        for l in range(1, len(pad_df)):
-            for c in range(len(pad_df[l])):
-                if (np.isnan(pad_df[l][c])):
-                    pad_df[l][c] = pad_df[l-1][c]
+        # replace nan with last value : index of the last non-nan row of each cell
+        last = np.where(np.isnan(pad_df), 0, np.arange(len(pad_df))[:, np.newaxis])
+        last = np.maximum.accumulate(last, axis=0)
+        pad_df = np.take_along_axis(pad_df, last, axis=0)
 
     df.from_numpy(pad_df)
     return df
@@ -393,6 +355,273 @@ def splitDataset(data, ratio:float=None, size:int=None):
 
     return train, test
 
+# |--------------------------------------------------------------------------------------------------------------------
+# | AIRPORT DISTANCES
+# |--------------------------------------------------------------------------------------------------------------------
+
+TOULOUSE_LATS = np.array([TOULOUSE[i]['lat'] for i in range(len(TOULOUSE))], dtype=np.float64)
+TOULOUSE_LONS = np.array([TOULOUSE[i]['long'] for i in range(len(TOULOUSE))], dtype=np.float64)
+
+# distances are capped to 50km
+AIRPORT_DISTANCE_CAP = 50
+
+def airport_distances(lats:np.float64_1d, lons:np.float64_1d,
+                      airport_lats:np.float64_1d, airport_lons:np.float64_1d) -> np.float64_2d:
+    """
+    Distance (km, capped) of each position to each airport,
+    (0, 0) positions are missing positions : their distances are 0
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    dists = GEO.np.distance(lats[:, np.newaxis], lons[:, np.newaxis],
+                            airport_lats[np.newaxis, :], airport_lons[np.newaxis, :])
+
+    dists = np.clip(dists / 1000, 0, AIRPORT_DISTANCE_CAP)
+    dists[(lats == 0) & (lons == 0)] = 0
+    return dists
+
+
+def toulouse_airportDistance(lats:"list[float]", lons:"list[float]"):
+    """
+    Compute the distance to the nearest airport
+    """
+    if (isinstance(lats, int) or isinstance(lats, float)):
+        return airport_distances([lats], [lons], TOULOUSE_LATS, TOULOUSE_LONS)[0]
+    return airport_distances(lats, lons, TOULOUSE_LATS, TOULOUSE_LONS)
+
+
+class AirportIndex:
+    """
+    Grid index of an airport list, for lists too large for the dense
+    (positions x airports) distance matrix.
+
+    Airports are bucketed in cells of at least the cap in both directions,
+    so the airports within the cap of a position are in the 3x3 cells around it.
+    The longitude cells wrap around the antimeridian (360 degrees split in equal cells),
+    and the rows within one cell of a pole are a single cell (covering all the longitudes).
+    """
+
+    def __init__(self, lats:np.float64_1d, lons:np.float64_1d, cap:float=AIRPORT_DISTANCE_CAP) -> None:
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.cap = cap
+
+        # cell size in degrees (same earth radius as GEO.distance) :
+        # longitude extent of the cap around the highest airport outside the polar rows
+        self.dlat = np.degrees(cap / 6378.137)
+        polar = self.__polar__(np.floor(self.lats / self.dlat).astype(np.int64))
+        max_lat = min(np.max(np.abs(self.lats[~polar]), initial=0) + self.dlat, 90 - self.dlat)
+        dlon = np.degrees(np.arcsin(min(1.0, np.sin(np.radians(self.dlat)) / np.cos(np.radians(max_lat)))))
+        self.nb_lon = max(int(360 // dlon), 1)
+        self.dlon = 360 / self.nb_lon
+
+        cells = self.__cell__(self.lats, self.lons)
+        self.order = np.argsort(cells, kind="stable")
+        self.cells, self.starts = np.unique(cells[self.order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.order))
+
+    def __polar__(self, i:np.int64_1d) -> np.bool_1d:
+        """
+        Rows within one cell of a pole
+        """
+        return ((i + 2) * self.dlat >= 90) | ((i - 1) * self.dlat <= -90)
+
+    def __cell__(self, lats:np.float64_1d, lons:np.float64_1d, di:int=0, dj:int=0) -> np.int64_1d:
+        i = np.floor(lats / self.dlat).astype(np.int64) + di
+        j = (np.floor((lons + 180) / self.dlon).astype(np.int64) + dj) % self.nb_lon
+        return (i << 32) + np.where(self.__polar__(i), 0, j)
+
+    def query(self, lats:np.float64_1d, lons:np.float64_1d) -> """tuple[
+            np.int64_1d, np.int64_1d, np.float64_1d]""":
+        """
+        Return the (position, airport, distance in km) of each airport within the cap,
+        missing (nan or (0, 0)) positions have no airport
+        """
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        positions = np.nonzero(~(np.isnan(lats) | np.isnan(lons) | ((lats == 0) & (lons == 0))))[0]
+        lats, lons = lats[positions], lons[positions]
+        if (len(self.cells) == 0):
+            return positions[:0], positions[:0], np.zeros(0, dtype=np.float64)
+
+        rows, airports = [], []
+        # with less than 3 longitude cells, the neighbours are every cell (each one scanned once)
+        neighbours = (-1, 0, 1) if (self.nb_lon >= 3) else range(self.nb_lon)
+        for di in (-1, 0, 1):
+            for dj in neighbours:
+                cells = self.__cell__(lats, lons, di, dj)
+                c = np.minimum(np.searchsorted(self.cells, cells), len(self.cells) - 1)
+                found = self.cells[c] == cells
+                if (dj != neighbours[0]):
+                    # a polar row is a single cell : scanned once
+                    found &= ~self.__polar__(np.floor(lats / self.dlat).astype(np.int64) + di)
+                starts, counts = self.starts[c[found]], self.ends[c[found]] - self.starts[c[found]]
+
+                # expand each (position, cell) into its airports
+                offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+                rows.append(np.repeat(np.nonzero(found)[0], counts))
+                airports.append(self.order[np.repeat(starts, counts) + offsets])
+
+        rows, airports = np.concatenate(rows), np.concatenate(airports)
+        dists = GEO.np.distance(lats[rows], lons[rows], self.lats[airports], self.lons[airports]) / 1000
+        near = dists <= self.cap
+        return positions[rows[near]], airports[near], dists[near]
+
+    def distances(self, lats:np.float64_1d, lons:np.float64_1d) -> np.float64_2d:
+        """
+        Same matrix as airport_distances, only the airports within the cap are computed
+        """
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        dists = np.full((len(lats), len(self.lats)), self.cap, dtype=np.float64)
+        dists[np.isnan(lats) | np.isnan(lons)] = np.nan
+        dists[(lats == 0) & (lons == 0)] = 0
+
+        rows, airports, near = self.query(lats, lons)
+        dists[rows, airports] = near
+        return dists
+
+
+# |--------------------------------------------------------------------------------------------------------------------
+# | INCREMENTAL FEATURE EXTRACTION (streaming)
+# |--------------------------------------------------------------------------------------------------------------------
+
+class WindowBuffer:
+    """
+    Feature rows of one streamed trajectory, written in place.
+    With a length, only the last length rows are kept (sliding window),
+    otherwise the buffer grows by doubling.
+    """
+
+    def __init__(self, nb_features:int, length:int=None) -> None:
+        self.length = length
+        self.data:np.float64_2d[ax.time, ax.feature] = np.zeros(
+            (64 if length is None else 2 * length, nb_features), dtype=np.float64)
+        self.start = 0
+        self.end = 0
+
+    def extend(self, rows:np.float64_2d[ax.time, ax.feature]) -> None:
+        if (self.length is not None and len(rows) > self.length):
+            rows = rows[-self.length:]
+
+        if (self.end + len(rows) > len(self.data)):
+            if (self.length is None):
+                data = np.zeros((max(2 * len(self.data), self.end + len(rows)), self.data.shape[1]))
+                data[:self.end] = self.data[:self.end]
+                self.data = data
+            else:
+                # move the rows still in the window back to the front (once every length rows)
+                keep = min(self.end - self.start, self.length - len(rows))
+                self.data[:keep] = self.data[self.end-keep:self.end]
+                self.start, self.end = 0, keep
+
+        self.data[self.end:self.end+len(rows)] = rows
+        self.end += len(rows)
+        if (self.length is not None):
+            self.start = max(self.start, self.end - self.length)
+
+    def view(self) -> np.float64_2d[ax.time, ax.feature]:
+        return self.data[self.start:self.end]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+
+class IncrementalFeatures:
+    """
+    Stateful df_to_feature_array for a streamed trajectory.
+
+    Each message only needs the previous one to compute its derived features
+    (padding, time, relative track, airport distances), so the rows are the same
+    as df_to_feature_array on the last two messages, filled with the pad values.
+    They are written straight into the window buffer.
+    Late or duplicated messages are ignored.
+    """
+
+    def __init__(self, CTX:dict, pad_values:np.float64_1d[ax.feature], length:int=None) -> None:
+        self.CTX = CTX
+        self.pad_values = np.asarray(pad_values, dtype=np.float64)
+        self.window = WindowBuffer(len(CTX["USED_FEATURES"]), length)
+        self.prev:np.float64_1d[ax.feature] = None
+
+    def update(self, raw_df:RingDataFrame) -> np.float64_2d[ax.time, ax.feature]:
+        """
+        Add the last message of the trajectory and return the window
+        """
+        msg = raw_df.last()
+        if (self.prev is not None and not(msg[0] > self.prev[0])):
+            return self.window.view()
+
+        rows = self.__rows__(raw_df.columns, msg)
+        if (rows is not None):
+            self.window.extend(rows)
+        self.prev = msg
+        return self.window.view()
+
+    @property
+    def nbytes(self) -> int:
+        return self.window.nbytes
+
+    def __rows__(self, columns:"dict[str, int]", msg:np.float64_1d) -> np.float64_2d[ax.time, ax.feature]:
+        prev = self.prev
+        T, PAD = columns["timestamp"], len(columns)
+
+        # |--------------------------
+        # | padding : prev, [gap rows], msg
+        if (prev is None):
+            block = np.append(msg, 0.0)[np.newaxis]
+
+        elif (self.CTX["INPUT_PADDING"] == "valid"):
+            block = np.zeros((2, PAD+1), dtype=np.float64)
+            block[0, :PAD], block[1, :PAD] = prev, msg
+
+        else:
+            block = np.full((int(msg[T] - prev[T]) + 1, PAD+1), np.nan, dtype=np.float64)
+            block[1:-1, PAD] = 1
+            block[0, :PAD], block[0, PAD] = prev, 0
+            block[-1, :PAD], block[-1, PAD] = msg, 0
+            if (self.CTX["INPUT_PADDING"] == "last"):
+                block[1:-1, :PAD] = prev
+                block[-1, :PAD] = np.where(np.isnan(msg), prev, msg)
+            block[:, T] = np.arange(prev[T], msg[T] + 1)
+
+        if (self.CTX["INPUT_PADDING"] == "valid"
+                and np.isnan(block[:, [columns["latitude"], columns["longitude"]]]).any()):
+            prntC(C.WARNING, "[IncrementalFeatures]:", "NaN in position")
+            return None
+
+        # |--------------------------
+        # | derived features (computed on the block, the previous message is dropped after)
+        relative_track = np.zeros(len(block), dtype=np.float64)
+        relative_track[1:] = angle_diffs(block[:-1, columns["track"]], block[1:, columns["track"]])
+        if (prev is not None):
+            block, relative_track = block[1:], relative_track[1:]
+
+        timestamp = block[:, T]
+        features = {name:block[:, i] for name, i in columns.items()}
+        features["pad"] = block[:, PAD]
+        features["day"] = (timestamp//86400 + 4) % 7
+        features["hour"] = (timestamp//3600 + 1) % 24
+        features["min"] = (timestamp//60) % 60
+        features["sec"] = timestamp % 60
+        features["altitude"] = np.clip(features["altitude"], 0, None)
+        features["geoaltitude"] = np.clip(features["geoaltitude"], 0, None)
+        features["relative_track"] = relative_track
+
+        if ("toulouse_0" in self.CTX["USED_FEATURES"]):
+            dists = toulouse_airportDistance(features["latitude"], features["longitude"])
+            for i in range(len(TOULOUSE)):
+                features["toulouse_"+str(i)] = dists[:, i]
+
+        if ("fingerprint" in self.CTX["USED_FEATURES"]):
+            # the rotation needs more than two messages
+            features["fingerprint"] = np.zeros(len(block), dtype=np.float64)
+
+        rows = np.stack([features[name] for name in self.CTX["USED_FEATURES"]], axis=1)
+        return np.where(np.isnan(rows), self.pad_values, rows)
+
+
 # |====================================================================================================================
 # | TRAJECTORY PRE PROCESS : SPHERICAL NORMALIZATION
 # |====================================================================================================================
@@ -513,50 +742,53 @@ def batch_preprocess(CTX:dict, flight:"np.float64_2d[ax.time, ax.feature]",
 # |====================================================================================================================
 
 
-def rotation_speed(lat:np.float64_1d, lon:np.float64_1d) -> np.int8_1d:
+def rotation_speed(lat:np.float64_1d, lon:np.float64_1d) -> "tuple[np.int8_1d, np.float64_1d]":
     """
-    Compute the rotation speed of the aircraft
+    Compute the rotation speed of the aircraft,
+    for a flight (time) or a batch of flights (sample, time)
     """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    rot = np.zeros(lat.shape, dtype=np.float64)
+    rot_speed = np.zeros(lat.shape, dtype=np.float64)
+    fingerprint = np.zeros(lat.shape, dtype=np.int8)
+    if (lat.shape[-1] < 2):
+        return fingerprint, rot_speed
+
+    # heading of each step, in the local frame of its first point
+    lat_a, lon_a, lat_b, lon_b = lat[..., :-1], lon[..., :-1], lat[..., 1:], lon[..., 1:]
+    x, y, z = spherical_to_cartesian(lat_b, lon_b)
+    x, y, z = z_rotation(x, y, z, np.radians(-lon_a))
+    x, y, z = y_rotation(x, y, z, np.radians(-lat_a))
+    rot[..., :-1] = np.degrees(np.arctan2(z, y))
+    rot[..., :-1][GEO.np.distance(lat_a, lon_a, lat_b, lon_b) < 0.000001] = np.nan
+    rot[..., -1] = rot[..., -2]
+
+    rot_speed[..., 1:-1] = angle_diffs(rot[..., :-2], rot[..., 1:-1])
+
+    # quantize (nan are 0)
+    fingerprint[rot_speed >= 0.1] = 1
+    fingerprint[rot_speed <= -0.1] = -1
+    return fingerprint, rot_speed
 
-    rot = np.zeros(len(lat), dtype=np.float64)
-    for i in range(0, len(lat)-1):
-
-        d = GEO.distance(lat[i], lon[i], lat[i+1], lon[i+1])
-        if (d < 0.000001):
-            rot[i] = np.nan
-            continue
-
-        bx, by, bz = spherical_to_cartesian(lat[i+1], lon[i+1])
-        ax, ay, az = spherical_to_cartesian(lat[i], lon[i])
-
-        bx, by, bz = z_rotation(bx, by, bz, np.radians(-lon[i]))
-        ax, ay, az = z_rotation(ax, ay, az, np.radians(-lon[i]))
-
-        bx, by, bz = y_rotation(bx, by, bz, np.radians(-lat[i]))
-        ax, ay, az = y_rotation(ax, ay, az, np.radians(-lat[i]))
-
-        rot[i] = np.degrees(np.arctan2(bz, by))
-
-    rot[-1] = rot[-2]
-
-
-    rot_speed = np.zeros(len(lat), dtype=np.float64)
-    for i in range(1, len(lat)-1):
-        rot_speed[i] = angle_diff(rot[i-1], rot[i])
-
-    fingerprint = np.zeros(len(lat), dtype=np.int8)
-
-    # remplace nan
-    fingerprint[np.isnan(rot_speed)] = 0
-    for i in range(len(rot_speed)):
-        if (abs(rot_speed[i]) < 0.1):
-            fingerprint[i] = 0
-        elif (rot_speed[i] > 0):
-            fingerprint[i] = 1
-        elif (rot_speed[i] < 0):
-            fingerprint[i] = -1
 
-    return fingerprint, rot_speed
+def fingerprint_robustness(df:DataFrame, copies:int=8, length:int=32) -> """tuple[
+        np.int8_2d, "list[np.float64_1d]", "list[DataFrame]"]""":
+    """
+    Fingerprint of the beginning of the flight, randomly rotated (copies first rows)
+    then randomly scaled (copies last rows).
+    Diagnostic of the fingerprint feature, see G_Main/Analysis/exp_FINGERPRINT.py
+    """
+    fingerprints = np.zeros((2 * copies, length), dtype=np.int8)
+    sub_dfs, sub_rot = [], []
+    for i in range(2 * copies):
+        if (i < copies):
+            sub_df = rotate_df(df[0:length].copy())
+        else:
+            sub_df = scale_df(df[0:length].copy())
+        sub_dfs.append(sub_df)
+        fingerprints[i], r = rotation_speed(sub_df["latitude"], sub_df["longitude"])
+        sub_rot.append(r)
+    return fingerprints, sub_rot, sub_dfs
 
 
 def rotate_df(df:DataFrame) -> DataFrame:
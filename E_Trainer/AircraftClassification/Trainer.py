@@ -316,6 +316,7 @@ class Trainer(AbstractTrainer):
 
         x_inputs, is_interesting = None, []
 
+        self.dl.streamer.ingest(x)
         for i in range(len(x)):
             sample, valid = self.dl.streamer.stream(x[i])
             is_interesting.append(valid)
@@ -295,6 +295,7 @@ class Trainer(AbstractTrainer):
         origin   = np.zeros((len(x), 3), dtype=np.float64)
 
         # stream message and build input batch
+        self.dl.streamer.ingest(x)
         for i in range(len(x)):
             sample, y_sample, valid, o = self.dl.streamer.stream(x[i])
             x_batch[i] = sample[0]
@@ -12,7 +12,6 @@ from   _Utils.DebugGui import GUI
 import _Utils.Color as C
 from   _Utils.Color import prntC
 from   _Utils.numpy import np, ax
-from   _Utils.save import write, load
 from   _Utils.ProgressBar import ProgressBar
 
 # |====================================================================================================================
@@ -44,6 +43,7 @@ class Trainer(AbstractTrainer):
         self.CTX = CTX
         self.model:_Model_ = Model(CTX)
         self.__makes_artifacts__()
+        self.model.ARTIFACTS = self.ARTIFACTS
         self.__init_GUI__()
         self.viz_model(self.ARTIFACTS)
         self.dl = DataLoader(CTX, "./A_Dataset/AircraftClassification/Train")
@@ -71,10 +71,10 @@ class Trainer(AbstractTrainer):
 
 
     def save(self) -> None:
-        write(self.ARTIFACTS+"/w", self.model.get_variables())
+        self.model.save(self.ARTIFACTS+"/db")
 
     def load(self) -> None:
-        self.model.set_variables(load(self.ARTIFACTS+"/w"))
+        self.model.load(self.ARTIFACTS+"/db")
 
 # |====================================================================================================================
 # |     TRAINING
@@ -122,15 +122,23 @@ class Trainer(AbstractTrainer):
 # |====================================================================================================================
 
 
-    def predict(self, x:"list[dict[str,object]]") -> np.bool_1d[ax.sample]:
+    def predict(self, x:"list[dict[str,object]]") -> "list[str]":
+        """
+        Check each message for replay, return the name of the replayed flight (or Unknown-flight)
+        """
+        matches = []
+        self.dl.streamer.ingest(x)
+        for i in range(len(x)):
+            tag, lat, lon, timestamp = self.dl.streamer.stream(x[i])
 
-        x_batch = np.zeros((len(x), self.CTX["INPUT_LEN"], self.CTX["FEATURES_IN"]), dtype=np.float64)
+            state = self.dl.streamer.get_state(tag)
+            if (state is None):
+                state = self.model.new_stream()
+                self.dl.streamer.set_state(tag, state)
 
-        for i in range(len(x)):
-            x_batch[i] = self.dl.streamer.stream(x[i])
+            matches.append(self.model.stream(state, lat, lon, timestamp))
 
-        y_ = self.model.predict(x_batch)
-        return y_
+        return matches
 
 
 # |====================================================================================================================
@@ -427,10 +427,15 @@ class Trainer(AbstractTrainer):
                 per_icao[icao] = []
             per_icao[icao].append(x[i])
 
-        for icao in per_icao.keys():
+        # the trajectories of all the icaos are gathered at once
+        # (an icao's messages only update its own trajectories)
+        icaos = list(per_icao.keys())
+        flights = self.dl.streamer.get_flights_with_icaos(
+            icaos, [per_icao[icao][0]["timestamp"] for icao in icaos])
+
+        for icao, (sample, tags) in zip(icaos, flights):
             msgs = per_icao[icao]
             TS = msgs[0]["timestamp"]
-            sample, tags = self.dl.streamer.get_flights_with_icao(icao, TS)
             timestamps = [TS for _ in range(len(sample))]
 
             y_ = self.model.predict(sample, timestamps)
@@ -441,6 +446,8 @@ class Trainer(AbstractTrainer):
             msg_tags = self.__associate__(msgs, y_, tags, sample)
             for i in range(len(msgs)):
                 msgs[i]["tag"] = msg_tags[i]
+            self.dl.streamer.ingest(msgs)
+            for i in range(len(msgs)):
                 self.dl.streamer.stream(msgs[i])
 
         tags = [x[i]["tag"] for i in range(len(x))]
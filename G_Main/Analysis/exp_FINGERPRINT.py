@@ -0,0 +1,33 @@
+# Robustness diagnostic of the fingerprint feature :
+# plot the fingerprint of randomly rotated and scaled copies of the beginning of each flight
+# python main.py Analysis FINGERPRINT [folder] [nb_flights]
+
+import matplotlib.pyplot as plt
+
+from _Utils.DataFrame import DataFrame
+import D_DataLoader.Utils as U
+
+import sys
+
+
+FOLDER = "./A_Dataset/AircraftClassification/Train"
+FLIGHTS = 1
+# copies to look at closely
+ABNORMAL = [0, 3, 7, 11]
+
+
+def __main__() -> None:
+    folder = sys.argv[3] if (len(sys.argv) > 3) else FOLDER
+    nb_flights = int(sys.argv[4]) if (len(sys.argv) > 4) else FLIGHTS
+
+    for file in U.list_flights(folder, nb_flights):
+        df = DataFrame(U.read_trajectory(file))
+        fingerprints, sub_rot, sub_dfs = U.fingerprint_robustness(df)
+
+        U.plot_fingerprint(fingerprints, sub_rot)
+
+        fig, ax = plt.subplots(len(ABNORMAL), 1, figsize=(10, 10*len(ABNORMAL)))
+        for i in range(len(ABNORMAL)):
+            ax[i].plot(sub_dfs[ABNORMAL[i]]["latitude"], sub_dfs[ABNORMAL[i]]["longitude"], c="tab:blue")
+            ax[i].scatter(sub_dfs[ABNORMAL[i]]["latitude"], sub_dfs[ABNORMAL[i]]["longitude"], c="tab:blue")
+        plt.show()
@@ -1,7 +1,8 @@
 
 from _Utils.numpy import np, ax
+import pandas as pd
 
-from _Utils.DataFrame import DataFrame
+from _Utils.DataFrame import Slab, RingDataFrame
 from _Utils.Color import prntC
 import _Utils.Color as C
 
@@ -21,6 +22,30 @@ __FEATURES__ = [
 ]
 
 __FEATURE_MAP__ = dict([[__FEATURES__[i], i] for i in range(len(__FEATURES__))])
+__FLAGS__ = ["onground", "alert", "spi"]
+
+# storage type of each feature
+__DTYPES__ = {
+    "timestamp":np.int64,
+    "latitude":np.float64, "longitude":np.float64,
+    "groundspeed":np.float32, "track":np.float32,
+    "vertical_rate":np.float32, "onground":np.uint8,
+    "alert":np.uint8, "spi":np.uint8, "squawk":np.uint16,
+    "altitude":np.float32, "geoaltitude":np.float32
+}
+
+# a trajectory with a longer gap between two messages is restarted
+MAX_GAP = 30 * 60
+# a trajectory without any message since TTL seconds (of stream time) is dropped
+TTL = 30 * 60
+# maximum number of trajectories kept, the least recently updated are dropped first
+MAX_TRAJECTORIES = 4096
+# maximum memory (in bytes) used by the trajectories and their cache
+MEMORY_BUDGET = 256 * 1024 * 1024
+# minimum number of messages kept per trajectory (the most recent ones).
+# Each solver requires the length of its window (see Streamer.require), so the capacity is
+# the largest HISTORY (+ HORIZON) in use. Readers of whole trajectories only see the last capacity messages
+CAPACITY = 256
 
 # |====================================================================================================================
 # | UTILS
@@ -40,65 +65,366 @@ def cast_msg(col:str, msg:object) -> float:
     else:
         return float(msg)
 
+
+def cast_column(col:str, values:np.ndarray) -> np.float64_1d:
+    """
+    Vectorized cast_msg : cast a whole column of messages at once
+    """
+    values = np.asarray(values)
+    if (values.dtype.kind in "biuf"):
+        return values.astype(np.float64)
+
+    values = values.astype(object)
+    missing = pd.isna(values) | (values == "")
+    if (col in __FLAGS__):
+        casted = (values == "True").astype(np.float64)
+        casted[missing] = np.nan
+        return casted
+
+    values[missing] = "nan"
+    return values.astype(str).astype(np.float64)
+
+
+def batch_columns(batch:"dict[str, np.ndarray]|pd.DataFrame|np.recarray") -> "dict[str, np.ndarray]":
+    """
+    Columns of a batch of messages given as a dict of arrays, a pandas DataFrame or a record array
+    """
+    if (isinstance(batch, pd.DataFrame)):
+        return {col:batch[col].to_numpy() for col in batch.columns}
+    if (isinstance(batch, np.ndarray)):
+        return {col:batch[col] for col in batch.dtype.names}
+    return {col:np.asarray(batch[col]) for col in batch}
+
+
+def nbytes(data:object) -> int:
+    """
+    Memory (in bytes) of a cache entry : its nbytes (numpy arrays, or the solvers' states defining it),
+    summed over the items of a list. Other objects are not counted
+    """
+    if (isinstance(data, (list, tuple))):
+        return sum([nbytes(d) for d in data])
+    return int(getattr(data, "nbytes", 0))
+
 # |====================================================================================================================
 # | ADSBStreamer : Replay ADS-B messages and store trajectories
 # |====================================================================================================================
 class Streamer:
-    def __init__(self) -> None:
-        self.trajectories:dict[str, DataFrame] = {}
+    """
+    Store the trajectory of each aircraft (identified by its tag), and a per-tag cache for the solvers.
+    All the trajectories live in one Slab (a few large column arrays), each one being
+    a ring buffer in its own slot keeping its last capacity messages
+    (at least CAPACITY, grown to the longest window required by a solver).
+
+    The memory is bounded : a trajectory is evicted (with its cache) when it has not been updated
+    since ttl seconds of stream time, or, least recently updated first, when there are more than
+    max_trajectories trajectories or when the slab and the caches use more than memory_budget bytes.
+    The slab only grows while it stays under both limits, otherwise the slot of an evicted trajectory is reused.
+    Solvers keeping their own per-tag state can register a callback with on_evict.
+
+    A single instance (STREAMER) is shared by all the solvers : each message is parsed and stored once,
+    and every solver keeps its derived features in the per-tag cache, under its own label.
+    """
+
+    def __init__(self, ttl:int=TTL, max_trajectories:int=MAX_TRAJECTORIES, memory_budget:int=MEMORY_BUDGET,
+                 capacity:int=CAPACITY) -> None:
+        self.trajectories:dict[str, RingDataFrame] = {}
         self.__cache__:dict[str, dict[str, object]] = {}
         self.__icao_to_tag__:dict[str, set] = {}
         self.__tag_to_icao__:dict[str, str] = {}
 
-    def clear(self) -> None:
-        self.trajectories.clear()
-        self.__cache__.clear()
-        self.__icao_to_tag__.clear()
-        self.__tag_to_icao__.clear()
+        self.ttl = ttl
+        self.max_trajectories = max_trajectories
+        self.memory_budget = memory_budget
+        self.capacity = capacity
+
+        self.slab = Slab(__FEATURES__, capacity, dtypes=[__DTYPES__[col] for col in __FEATURES__],
+                         max_slots=max_trajectories)
+        # tag, last timestamp and cache size of each slot
+        self.__tags__:"list[str]" = [None] * self.slab.slots
+        self.__last_seen__ = np.zeros(self.slab.slots, dtype=np.float64)
+        self.__cache_nbytes__ = np.zeros(self.slab.slots, dtype=np.int64)
+        # most recent timestamp of the stream, and of the last ttl check
+        self.__clock__ = 0
+        self.__swept__ = 0
+        self.__on_evict__:"list[callable]" = []
+
+    def clear(self, label:str=None) -> None:
+        """
+        Drop the cache of a solver (its label), and the trajectories no other solver keeps a cache for.
+        Without label, reset the whole streamer
+        """
+        if (label is not None):
+            for tag in list(self.trajectories.keys()):
+                cache = self.__cache__.get(tag, {})
+                cache.pop(label, None)
+                if (len(cache) == 0):
+                    self.remove(tag)
+            return
 
-    def add(self, x:"dict[str, object]", tag:str=None) -> DataFrame:
+        on_evict = self.__on_evict__
+        self.__init__(self.ttl, self.max_trajectories, self.memory_budget, self.capacity)
+        self.__on_evict__ = on_evict
+
+    def require(self, length:int) -> None:
+        """
+        Keep at least the last length messages of each trajectory
+        (to call by each solver with the length of its window)
+        """
+        if (length > self.capacity):
+            self.capacity = length
+            self.slab.reserve(length)
+            if (self.slab.nbytes > self.memory_budget):
+                prntC(C.WARNING, f"The trajectories of {length} messages use {self.slab.nbytes} bytes,",
+                      f"more than the memory budget ({self.memory_budget} bytes).")
+
+    def on_evict(self, callback:"callable") -> None:
+        """
+        Register a function called with the tag of each evicted trajectory
+        """
+        self.__on_evict__.append(callback)
+
+    def add(self, x:"dict[str, object]", tag:str=None) -> RingDataFrame:
         if (tag == None):
             tag = x['icao24']
 
-        if (x['icao24'] not in self.__icao_to_tag__):
-            self.__icao_to_tag__[x['icao24']] = set()
-        self.__icao_to_tag__[x['icao24']].add(tag)
-        self.__tag_to_icao__[tag] = x["icao24"]
-
+        # the same message is given by every solver using the shared streamer : store it once
+        timestamp = cast_msg("timestamp", x.get("timestamp", np.nan))
+        if (tag in self.trajectories and self.trajectories[tag].get(timestamp) is not None):
+            return self.trajectories[tag]
 
-        if tag not in self.trajectories:
-            self.trajectories[tag] = DataFrame(len(__FEATURES__))
-            self.trajectories[tag].setColums(__FEATURES__)
+        self.__register__(tag, x.get("icao24", tag))
 
         x = [cast_msg(col, x.get(col, np.nan)) for col in __FEATURES__]
+        self.__check_gap__(tag, timestamp)
+        self.trajectories[tag].set(x)
+
+        slot = self.trajectories[tag].slot
+        if not(timestamp <= self.__last_seen__[slot]):
+            self.__last_seen__[slot] = timestamp
+        if (timestamp > self.__clock__):
+            self.__clock__ = timestamp
+        self.__evict__(slot)
+
+        return self.trajectories[tag]
+
+    def add_batch(self, batch:"dict[str, np.ndarray]|pd.DataFrame|np.recarray", tags:"np.str_1d"=None)\
+            -> np.str_1d:
+        """
+        Add a batch of messages (typically one time tick) given column by column.
+        Columns are casted at once, then all the new rows are scattered in the slab at once.
+        The trajectories are the same as with add() on each message in the batch order :
+        the trajectories needing it (late, duplicated or unordered messages, long gaps)
+        get their messages one by one, like add() does.
+        Return the updated tags
+        """
+        columns = batch_columns(batch)
+        icaos = np.asarray(columns["icao24"]).astype(str)
+        if (tags is None):
+            tags = columns.get("tag", icaos)
+        tags = np.asarray(tags).astype(str)
+        if (len(tags) == 0):
+            return tags
+
+        x = np.full((len(icaos), len(__FEATURES__)), np.nan, dtype=np.float64)
+        for col in __FEATURES__:
+            if (col in columns):
+                x[:, __FEATURE_MAP__[col]] = cast_column(col, columns[col])
+
+        # group by tag, in chronological order (a duplicated message stays after the first one)
+        TS = __FEATURE_MAP__['timestamp']
+        order = np.lexsort((x[:, TS], tags))
+        tags, icaos, x = tags[order], icaos[order], x[order]
+        starts = np.flatnonzero(np.r_[True, tags[1:] != tags[:-1]])
+        ends = np.r_[starts[1:], len(tags)]
+        counts = ends - starts
+        group = np.repeat(np.arange(len(starts)), counts)
+        ranks = np.arange(len(tags)) - starts[group]
+
+        updated = tags[starts].tolist()
+        kept = [self.trajectories[tag].slot for tag in updated if tag in self.trajectories]
+        for g in np.flatnonzero([tag not in self.trajectories for tag in updated]):
+            kept.append(self.__register__(updated[g], str(icaos[starts[g]]), kept))
+        slots = np.array([self.trajectories[tag].slot for tag in updated], dtype=np.int64)
+
+        # messages older than the trajectory, duplicated, not in chronological order in the batch
+        # or after a long gap in the batch are added one by one
+        first = x[starts, TS]
+        last = self.slab.last(slots, TS)
+        same = group[1:] == group[:-1]
+        irregular = np.zeros(len(tags), dtype=bool)
+        irregular[1:] = same & ((x[1:, TS] <= x[:-1, TS]) | (order[1:] < order[:-1])
+                                | (x[1:, TS] - x[:-1, TS] > MAX_GAP))
+        slow = (first <= last) | (np.bincount(group, irregular, minlength=len(starts)) > 0)
+
+        # restart the other trajectories after a long gap
+        for g in np.flatnonzero(~slow & (last > 0) & (first - last > MAX_GAP)):
+            self.__check_gap__(updated[g], first[g])
+
+        skip = np.maximum(counts - self.capacity, 0)
+        fast = ~slow[group] & (ranks >= skip[group])
+        self.slab.push(slots[group[fast]], (ranks - skip[group])[fast], x[fast])
+        for g in np.flatnonzero(slow):
+            rows = np.arange(starts[g], ends[g])
+            for row in x[rows[np.argsort(order[rows])]]:
+                if (self.trajectories[updated[g]].get(row[TS]) is None):
+                    self.__check_gap__(updated[g], row[TS])
+                    self.trajectories[updated[g]].add(row)
+
+        self.__touch__(slots, x[ends-1, TS])
+        self.__evict__(slots)
+        return tags[starts]
 
-        last_timestamp = self.trajectories[tag].array[-1][__FEATURE_MAP__['timestamp']]
-        timestamp = x[__FEATURE_MAP__['timestamp']]
-        MAX_GAP = 30 * 60
+    def add_messages(self, msgs:"list[dict[str, object]]") -> np.str_1d:
+        """
+        add_batch for messages given as add() takes them (tagged by their "tag", else their icao24)
+        """
+        columns = {col:np.array([msg.get(col, np.nan) for msg in msgs], dtype=object)
+                   for col in ["icao24"] + __FEATURES__}
+        tags = np.array([msg.get("tag", msg["icao24"]) for msg in msgs], dtype=str)
+        return self.add_batch(columns, tags)
+
+    def windows(self, tags:"list[str]", length:int) -> "tuple[np.float64_3d[ax.sample, ax.time, ax.feature], np.int64_1d]":
+        """
+        Last length messages of many trajectories, gathered at once
+        (right aligned and nan padded), with the number of valid messages of each one
+        """
+        slots = np.array([self.trajectories[tag].slot for tag in tags], dtype=np.int64)
+        return self.slab.gather(slots, length)
+
+    def __register__(self, tag:str, icao:str, kept:"list[int]|None"=None) -> int:
+        # the icao of a tag is the one of its first message, never re-mapped
+        # (e.g. a solver giving the tag as icao24) : a tag is in a single icao set
+        if (tag in self.trajectories):
+            return self.trajectories[tag].slot
+
+        # make room before allocating : the slab doesn't grow past the limits
+        # (the slots in kept are being updated, they are not evicted)
+        if (len(self.slab.free) == 0):
+            self.__evict__([] if kept is None else kept, incoming=1)
+
+        if (icao not in self.__icao_to_tag__):
+            self.__icao_to_tag__[icao] = set()
+        self.__icao_to_tag__[icao].add(tag)
+        self.__tag_to_icao__[tag] = icao
+
+        slot = self.slab.alloc()
+        if (self.slab.slots > len(self.__tags__)):
+            self.__tags__ += [None] * (self.slab.slots - len(self.__tags__))
+            self.__last_seen__ = np.resize(self.__last_seen__, self.slab.slots)
+            self.__cache_nbytes__ = np.resize(self.__cache_nbytes__, self.slab.slots)
+        self.trajectories[tag] = RingDataFrame(self.slab, slot)
+        self.__tags__[slot] = tag
+        self.__last_seen__[slot] = self.__clock__
+        self.__cache_nbytes__[slot] = 0
+        return slot
+
+    def __check_gap__(self, tag:str, timestamp:int) -> None:
+        last_timestamp = self.trajectories[tag].last_key()
         if (last_timestamp > 0 and timestamp - last_timestamp > MAX_GAP):
-            prntC(C.WARNING, f"Gap of {timestamp - last_timestamp} seconds for {tag} at timestamp {x[__FEATURE_MAP__['timestamp']]}.")
+            prntC(C.WARNING, f"Gap of {timestamp - last_timestamp} seconds for {tag} at timestamp {timestamp}.")
             self.trajectories[tag].clear()
             self.__cache__[tag] = {}
+            self.__cache_nbytes__[self.trajectories[tag].slot] = 0
 
-        if(not(self.trajectories[tag].set(x))):
-            prntC(C.WARNING, f"Duplicate message for {tag} at timestamp {x[__FEATURE_MAP__['timestamp']]}")
-
-        return self.trajectories[tag]
-
-    def set(self, x:"dict[str, object]", tag:str) -> DataFrame:
+    def set(self, x:"dict[str, object]", tag:str) -> RingDataFrame:
         if (tag not in self.trajectories):
             self.add(x, tag)
 
         x = [cast_msg(col, x.get(col, np.nan)) for col in __FEATURES__]
 
 
-    # def remove(self, tag:str) -> DataFrame:
-    #     if (tag in self.trajectories):
-    #         self.trajectories.pop(tag)
-    #         self.__icao_to_tag__[self.__tag_to_icao__[tag]].remove(tag)
-            # self.__tag_to_icao__.pop(tag)
+    def remove(self, tag:str) -> None:
+        if (tag not in self.trajectories):
+            return
+
+        slot = self.trajectories.pop(tag).slot
+        self.slab.release(slot)
+        self.__tags__[slot] = None
+        self.__cache_nbytes__[slot] = 0
+        self.__cache__.pop(tag, None)
+
+        icao = self.__tag_to_icao__.pop(tag, None)
+        tags = self.__icao_to_tag__.get(icao, set())
+        tags.discard(tag)
+        if (len(tags) == 0):
+            self.__icao_to_tag__.pop(icao, None)
 
-    def get(self, tag:str) -> DataFrame:
+        for callback in self.__on_evict__:
+            callback(tag)
+
+# |====================================================================================================================
+# |     EVICTION
+# |====================================================================================================================
+
+    def __touch__(self, slots:np.int64_1d, timestamps:np.float64_1d) -> None:
+        self.__last_seen__[slots] = np.fmax(self.__last_seen__[slots], timestamps)
+        clock = np.nanmax(timestamps, initial=self.__clock__)
+        if (clock > self.__clock__):
+            self.__clock__ = clock
+
+    def __measure__(self) -> None:
+        """
+        Size of the cache of each trajectory
+        (the solvers update their entries in place : measured once per second of stream time)
+        """
+        for tag, df in self.trajectories.items():
+            self.__cache_nbytes__[df.slot] = sum([nbytes(data) for data in self.__cache__.get(tag, {}).values()])
+
+    def __evict__(self, current:"np.int64_1d|list[int]|int", incoming:int=0) -> None:
+        """
+        Drop the least recently updated trajectories until the limits are respected,
+        leaving room for incoming new trajectories (the trajectories that have just been updated are kept).
+        Without free slot, the slab grows only if its new size fits in the memory budget
+        """
+        sweep = self.__clock__ > self.__swept__
+        if (sweep):
+            self.__swept__ = self.__clock__
+            self.__measure__()
+
+        cached = int(self.__cache_nbytes__.sum())
+        over = len(self.trajectories) + incoming - self.max_trajectories
+        missing = incoming - len(self.slab.free)
+        if (missing > 0 and self.slab.grown_slots * self.slab.slot_nbytes + cached > self.memory_budget):
+            over = max(over, missing)
+        # the slab never shrinks : only the caches can be freed
+        excess = min(self.slab.nbytes + cached - self.memory_budget, cached)
+        if (over <= 0 and excess <= 0 and not(sweep)):
+            return
+
+        candidates = self.slab.live.copy()
+        candidates[current] = False
+
+        # idle trajectories (checked once per second of stream time)
+        if (sweep):
+            idle = np.flatnonzero(candidates & (self.__clock__ - self.__last_seen__ > self.ttl))
+            excess -= self.__cache_nbytes__[idle].sum()
+            for slot in idle.tolist():
+                self.remove(self.__tags__[slot])
+            candidates[idle] = False
+            over -= len(idle)
+
+        # least recently updated trajectories over the limits
+        if (over <= 0 and excess <= 0):
+            return
+        slots = np.flatnonzero(candidates)
+        if (excess > 0):
+            slots = slots[np.argsort(self.__last_seen__[slots], kind="stable")]
+            freed = np.cumsum(self.__cache_nbytes__[slots])
+            slots = slots[:max(over, np.searchsorted(freed, excess) + 1)]
+        elif (over < len(slots)):
+            slots = slots[np.argpartition(self.__last_seen__[slots], over)[:over]]
+        for slot in slots.tolist():
+            self.remove(self.__tags__[slot])
+
+    @property
+    def memory(self) -> int:
+        """
+        Memory (in bytes) used by the trajectories (the whole slab) and their cache
+        """
+        self.__measure__()
+        return self.slab.nbytes + int(self.__cache_nbytes__.sum())
+
+    def get(self, tag:str) -> RingDataFrame:
         return self.trajectories.get(tag, None)
 
     def cache(self, label:str, tag:str, data:object=None)->"object|None":
@@ -109,6 +435,9 @@ class Streamer:
             self.__cache__[tag] = {}
 
         self.__cache__[tag][label] = data
+        if (tag in self.trajectories):
+            self.__cache_nbytes__[self.trajectories[tag].slot] = \
+                sum([nbytes(data) for data in self.__cache__[tag].values()])
 
     def __get_cache__(self, tag:str, label:str) -> "object|None":
         tmp = self.__cache__.get(tag, None)
@@ -120,3 +449,10 @@ class Streamer:
         return self.__icao_to_tag__.get(icao, set())
     def get_icao_for_tag(self, tag:str) -> str:
         return self.__tag_to_icao__.get(tag, None)
+
+
+# |====================================================================================================================
+# | SHARED INGEST : one streamer for all the solvers
+# |====================================================================================================================
+
+STREAMER = Streamer()
@@ -5,8 +5,14 @@ from _Utils.numpy import np, ax
 import pandas as pd
 
 class DataFrame:
-    def __init__(self, arg) -> None:
+    # maximum number of late rows waiting to be merged
+    REORDER_LIMIT = 32
+
+    def __init__(self, arg, reserve:"list|None"=None) -> None:
         self.array = None
+        self.pending:"list[np.float64_1d]" = []
+        # the buffer (and column map) is shared with views : copy it before writing in it
+        self.shared = False
 
         if (type(arg) == int):
             self.array = np.zeros((16, arg), dtype=np.float64)
@@ -22,13 +28,57 @@ class DataFrame:
             self.from_numpy(arg)
             self.columns = {str(i):i for i in range(arg.shape[1])}
 
+        if (reserve is not None and len(reserve) > 0):
+            self.reserve(reserve)
+
+    def reserve(self, names:list):
+        """
+        Allocate up front the columns that will be added later,
+        add_column then fills them in place instead of reallocating the array
+        """
+        self.__flush__()
+        width = len(self.columns) + len([name for name in names if name not in self.columns])
+        if (width > self.array.shape[1]):
+            array = np.zeros((len(self.array), width), dtype=np.float64)
+            array[:, :self.array.shape[1]] = self.array
+            self.array = array
+            if (self.shared):
+                self.columns = self.columns.copy()
+                self.shared = False
+
     def copy(self):
+        self.__flush__()
         df = DataFrame(self.array.shape[1])
         df.array = self.array.copy()
         df.len = self.len
         df.columns = self.columns.copy()
         return df
 
+    @staticmethod
+    def wrap(array:np.float64_2d[ax.time, ax.feature], columns:"dict[str, int]", shared:bool=False) -> "DataFrame":
+        """
+        DataFrame on an existing array (no copy)
+        """
+        df = DataFrame.__new__(DataFrame)
+        df.array, df.len, df.columns = array, len(array), columns
+        df.pending, df.shared = [], shared
+        return df
+
+    def __view__(self, rows) -> "DataFrame":
+        """
+        Lightweight view on some rows : shares the buffer and the column map,
+        until one of them is modified (copy on write)
+        """
+        self.__flush__()
+        self.shared = True
+        return DataFrame.wrap(self.array[:self.len][rows], self.columns, shared=True)
+
+    def __own__(self):
+        if (self.shared):
+            self.array = self.array.copy()
+            self.columns = self.columns.copy()
+            self.shared = False
+
 
     def __insert__(self, i, value):
         if (i > self.len):
@@ -36,11 +86,12 @@ class DataFrame:
         if (i < 0):
             raise IndexError("Index out of range")
 
+        self.__own__()
         if (self.len == len(self.array)):
             self.array = np.resize(self.array, (self.len*2, self.array.shape[1]))
 
         self.array[i+1:self.len+1] = self.array[i:self.len]
-        self.array[i] = value
+        self.array[i, :len(value)] = value
         self.len += 1
 
     def __set__(self, i, value):
@@ -48,7 +99,8 @@ class DataFrame:
             raise IndexError("Index out of range")
         if (i < 0):
             raise IndexError("Index out of range")
-        self.array[i] = value
+        self.__own__()
+        self.array[i, :len(value)] = value
 
     def __remove__(self, i):
         if (i > self.len):
@@ -56,6 +108,7 @@ class DataFrame:
         if (i < 0):
             raise IndexError("Index out of range")
 
+        self.__own__()
         self.array[i:self.len-1] = self.array[i+1:self.len]
         self.len -= 1
 
@@ -73,110 +126,118 @@ class DataFrame:
 
         if (self.len == len(self.array)):
             self.array = np.resize(self.array, (self.len*2, self.array.shape[1]))
-        self.array[self.len] = value
+        self.array[self.len, :len(value)] = value
         self.len += 1
 
 
-    def add(self, value):
-        key = value[0]
-        left = 0
-        right = self.len
-        mid = (left + right)//2
-
-        while (left < right):
-            if (self.array[mid][0] < key):
-                left = mid+1
-            else:
-                right = mid
-
-            mid = (left + right)//2
+    def __search__(self, key) -> int:
+        # index of the first row with a timestamp >= key
+        return int(np.searchsorted(self.array[:self.len, 0], key))
 
-        if (mid < self.len and self.array[mid][0] == key):
-            return False
-        self.__insert__(mid, value)
-        return True
+    def add(self, value):
+        return self.__put__(value, replace=False)
 
     def set(self, value):
+        return self.__put__(value, replace=True)
+
+    def __put__(self, value, replace:bool) -> bool:
+        """
+        Insert a row, sorted by its first column (the timestamp).
+        A row newer than the last one is appended in O(1). An older (late) row goes
+        in a small reorder buffer, merged in the array in one pass when it is full
+        or when the dataframe is read.
+        """
         key = value[0]
-        left = 0
-        right = self.len
-        mid = (left + right)//2
-
-        while (left < right):
-            if (self.array[mid][0] < key):
-                left = mid+1
-            else:
-                right = mid
-
-            mid = (left + right)//2
+        if (self.len == 0 or key > self.array[self.len-1][0]):
+            self.__append__(value)
+            return True
 
+        mid = self.__search__(key)
         if (mid < self.len and self.array[mid][0] == key):
-            self.__set__(mid, value)
+            if (replace):
+                self.__set__(mid, value)
             return False
-        self.__insert__(mid, value)
+
+        for p in range(len(self.pending)):
+            if (self.pending[p][0] == key):
+                if (replace):
+                    self.pending[p] = np.array(value, dtype=np.float64)
+                return False
+
+        self.pending.append(np.array(value, dtype=np.float64))
+        if (len(self.pending) >= self.REORDER_LIMIT):
+            self.__flush__()
         return True
 
+    def __flush__(self):
+        """
+        Merge the reorder buffer in the array
+        """
+        if (len(self.pending) == 0):
+            return
+        pending = np.zeros((len(self.pending), self.array.shape[1]), dtype=np.float64)
+        for p in range(len(self.pending)):
+            pending[p, :len(self.pending[p])] = self.pending[p]
+        pending = pending[np.argsort(pending[:, 0], kind="stable")]
+        self.pending = []
+        self.__own__()
+
+        rows = np.insert(self.array[:self.len], np.searchsorted(self.array[:self.len, 0], pending[:, 0]), pending, axis=0)
+        l = max(2**int(np.ceil(np.log2(len(rows)))), len(self.array))
+        self.array = np.resize(self.array, (l, self.array.shape[1]))
+        self.array[:len(rows)] = rows
+        self.len = len(rows)
+
     def add_column(self, name, value):
+        self.__flush__()
+        self.__own__()
         if (name in self.columns):
             self.array[:self.len, self.columns[name]] = value
             return
 
+        # use a reserved column if any
         self.columns[name] = len(self.columns)
-        self.array = np.append(self.array, np.zeros((len(self.array), 1)), axis=1)
-        self.array[:self.len, -1] = value
+        if (len(self.columns) > self.array.shape[1]):
+            self.array = np.append(self.array, np.zeros((len(self.array), 1)), axis=1)
+        self.array[:self.len, self.columns[name]] = value
 
     def setColumValue(self, name:str, i:int, value:float):
+        self.__flush__()
+        self.__own__()
         self.array[i, self.columns[name]] = value
 
     def getColumns(self, names:list)-> np.float64_2d[ax.time, ax.feature]:
+        self.__flush__()
         return self.array[:self.len, [self.columns[name] for name in names]]
     def setColums(self, names:list):
         self.columns = {name:i for i, name in enumerate(names)}
 
     def get(self, key) -> np.float64_1d[ax.feature]:
-        left = 0
-        right = self.len
-        mid = (left + right)//2
-
-        while (left < right):
-            if (self.array[mid][0] < key):
-                left = mid+1
-            else:
-                right = mid
-
-            mid = (left + right)//2
-
+        self.__flush__()
+        mid = self.__search__(key)
         if (mid >= self.len or self.array[mid][0] != key):
             return None
-        return self.array[mid]
+        return self.array[mid, :len(self.columns)]
 
     def subset(self, key_end):
-        left = 0
-        right = self.len
-        mid = (left + right)//2
-
-        while (left < right):
-            if (self.array[mid][0] < key_end):
-                left = mid+1
-            else:
-                right = mid
-
-            mid = (left + right)//2
-
+        self.__flush__()
+        mid = self.__search__(key_end)
         if (mid >= self.len or self.array[mid][0] != key_end):
             return None
 
-        sub_df = DataFrame(self.array.shape[1])
-        sub_df.array = self.array[:mid+1]
-        sub_df.len = len(sub_df.array)
-        sub_df.columns = self.columns.copy()
-        return sub_df
+        return self.__view__(slice(0, mid+1))
 
 
     def to_numpy(self):
-        return self.array[:self.len]
+        self.__flush__()
+        return self.array[:self.len, :len(self.columns)]
 
     def from_numpy(self, array):
+        self.pending = []
+        if (self.shared):
+            self.array = None
+            self.columns = self.columns.copy()
+            self.shared = False
         if self.array is None:
             l = len(array)
             l = 2**int(np.ceil(np.log2(l)))
@@ -185,13 +246,15 @@ class DataFrame:
             self.array[:len(array)] = array
             return
 
-        if (self.array.shape[1] != len(array[0])):
-            del self.array
+        # (a narrower array keeps the reserved columns)
+        if (self.array.shape[1] < len(array[0])):
+            self.array = None
             self.from_numpy(array)
+            return
 
         if self.array.shape[0] >= len(array):
             self.len = len(array)
-            self.array[:len(array)] = array
+            self.array[:len(array), :len(array[0])] = array
             return
 
         # extend array
@@ -199,26 +262,33 @@ class DataFrame:
         l = 2**int(np.ceil(np.log2(l)))
         self.array = np.resize(self.array, (l, self.array.shape[1]))
         self.len = len(array)
-        self.array[:len(array)] = array
+        self.array[:len(array), :len(array[0])] = array
 
     def clear(self):
         self.len = 0
+        self.pending = []
+        self.__own__()
         self.array = np.zeros((16, self.array.shape[1]), dtype=np.float64)
 
 
 
     def __str__(self) -> str:
-        return str(self.array[:self.len])
+        return str(self.to_numpy())
     def __repr__(self) -> str:
-        return str(self.array[:self.len])
+        return str(self.to_numpy())
     def __len__(self):
+        self.__flush__()
         return self.len
     # [] operator
     def __getitem__(self, key):
+        self.__flush__()
         if isinstance(key, str):
             return self.array[:self.len, self.columns[key]]
 
-        value = self.array[:self.len][key]
+        if isinstance(key, slice):
+            return self.__view__(key)
+
+        value = self.array[:self.len, :len(self.columns)][key]
 
         if isinstance(value, np.ndarray) and len(value.shape) == 2:
             sub = DataFrame(value)
@@ -228,7 +298,333 @@ class DataFrame:
         return value
 
     def __setitem__(self, key, value):
+        self.__flush__()
         if isinstance(key, str):
             self.setColumValue(key, slice(0, self.len), value)
         if (isinstance(key, tuple)):
-            self.setColumValue(key[0], key[1], value)
\ No newline at end of file
+            self.setColumValue(key[0], key[1], value)
+
+
+class Slab:
+    """
+    Ring buffers of every live trajectory, stored as struct-of-arrays :
+    one preallocated (slots, capacity) array per column.
+    Each trajectory owns a slot (a row of every column), freed slots are reused.
+    Operations on many trajectories at once are single vectorized gathers / scatters.
+
+    Each column has its own (compact) dtype. Values are given and read as float64 :
+    a missing value (nan) of an integer column is stored as the max of its dtype.
+    The number of slots doubles when they are all used, up to max_slots.
+    """
+
+    def __init__(self, columns:list, capacity:int, slots:int=64, dtypes:list=None, max_slots:int=None) -> None:
+        if (max_slots is not None):
+            slots = min(slots, max_slots)
+        self.max_slots = max_slots
+        if (dtypes is None):
+            dtypes = [np.float64] * len(columns)
+        self.columns = {name:i for i, name in enumerate(columns)}
+        self.capacity = capacity
+        self.dtypes = [np.dtype(dtype) for dtype in dtypes]
+        self.integer = [dtype.kind in "iu" for dtype in self.dtypes]
+        self.missing = [np.iinfo(dtype).max if dtype.kind in "iu" else np.nan for dtype in self.dtypes]
+        self.data:"list[np.ndarray]" = [np.zeros((slots, capacity), dtype=dtype) for dtype in self.dtypes]
+        self.heads = np.zeros(slots, dtype=np.int64) # next position to write
+        self.lens = np.zeros(slots, dtype=np.int64)
+        self.live = np.zeros(slots, dtype=bool)
+        self.free:"list[int]" = list(range(slots-1, -1, -1))
+        self.slot_nbytes = sum([col.itemsize for col in self.data]) * capacity
+
+    @property
+    def slots(self) -> int:
+        return len(self.heads)
+
+    def alloc(self) -> int:
+        if (len(self.free) == 0):
+            self.__grow__()
+        slot = self.free.pop()
+        self.heads[slot], self.lens[slot], self.live[slot] = 0, 0, True
+        return slot
+
+    def release(self, slot:int) -> None:
+        self.live[slot] = False
+        self.free.append(slot)
+
+    @property
+    def grown_slots(self) -> int:
+        """
+        Number of slots after the next growth
+        """
+        if (self.max_slots is None):
+            return 2 * self.slots
+        return max(min(2 * self.slots, self.max_slots), self.slots)
+
+    def __grow__(self) -> None:
+        slots, added = self.slots, self.grown_slots - self.slots
+        if (added == 0):
+            raise MemoryError(f"All the {slots} slots of the slab are used")
+        self.data = [np.concatenate([col, np.zeros((added, self.capacity), dtype=col.dtype)]) for col in self.data]
+        self.heads = np.concatenate([self.heads, np.zeros(added, dtype=np.int64)])
+        self.lens = np.concatenate([self.lens, np.zeros(added, dtype=np.int64)])
+        self.live = np.concatenate([self.live, np.zeros(added, dtype=bool)])
+        self.free = list(range(slots+added-1, slots-1, -1))
+
+    def reserve(self, capacity:int) -> None:
+        """
+        Grow the capacity of every slot (the rows are kept, unrolled in chronological order)
+        """
+        if (capacity <= self.capacity):
+            return
+        pos = (self.heads - self.lens)[:, None] + np.arange(self.capacity)
+        pos %= self.capacity
+        rows = np.arange(self.slots)[:, None]
+        for c in range(len(self.data)):
+            col = np.zeros((self.slots, capacity), dtype=self.dtypes[c])
+            col[:, :self.capacity] = self.data[c][rows, pos]
+            self.data[c] = col
+        self.heads = self.lens.copy()
+        self.capacity = capacity
+        self.slot_nbytes = sum([col.itemsize for col in self.data]) * capacity
+
+# |====================================================================================================================
+# |     COMPACT STORAGE
+# |====================================================================================================================
+
+    def encode(self, c:int, values:np.float64_1d) -> np.ndarray:
+        if not(self.integer[c]):
+            return values
+        values = np.asarray(values)
+        return np.where(np.isnan(values), self.missing[c], values).astype(self.dtypes[c])
+
+    def decode(self, c:int, values:np.ndarray) -> np.float64_1d:
+        if (self.dtypes[c] == np.float64):
+            return values
+        decoded = values.astype(np.float64)
+        if (self.integer[c]):
+            decoded[values == self.missing[c]] = np.nan
+        return decoded
+
+# |====================================================================================================================
+# |     VECTORIZED ACCESS
+# |====================================================================================================================
+
+    def positions(self, slots:np.int64_1d, start:np.int64_1d, length:int) -> np.int64_2d:
+        """
+        Buffer positions of the rows [start, start+length[ of each slot
+        """
+        first = self.heads[slots] - self.lens[slots] + start
+        return (first[:, None] + np.arange(length)) % self.capacity
+
+    def last(self, slots:np.int64_1d, column:int=0) -> np.float64_1d:
+        """
+        Value of a column in the last row of each slot (nan if empty)
+        """
+        values = self.decode(column, self.data[column][slots, (self.heads[slots] - 1) % self.capacity])
+        return np.where(self.lens[slots] > 0, values, np.nan)
+
+    def gather(self, slots:np.int64_1d, length:int) -> "tuple[np.float64_3d[ax.sample, ax.time, ax.feature], np.int64_1d]":
+        """
+        Last length rows of many slots at once (right aligned, nan padded on the left).
+        Return the windows and the number of valid rows of each one
+        """
+        lens = np.minimum(self.lens[slots], length)
+        pos = self.positions(slots, self.lens[slots] - length, length)
+        windows = np.empty((len(slots), length, len(self.data)), dtype=np.float64)
+        for c in range(len(self.data)):
+            windows[:, :, c] = self.decode(c, self.data[c][slots[:, None], pos])
+        windows[np.arange(length)[None, :] < (length - lens)[:, None]] = np.nan
+        return windows, lens
+
+    def push(self, slots:np.int64_1d, ranks:np.int64_1d, rows:np.float64_2d[ax.sample, ax.feature]) -> None:
+        """
+        Append rows at the end of their slot.
+        ranks gives the order of the rows of a same slot (0, 1, ...),
+        rows of the same slot must be given with consecutive ranks
+        """
+        pos = (self.heads[slots] + ranks) % self.capacity
+        for c in range(len(self.data)):
+            self.data[c][slots, pos] = self.encode(c, rows[:, c])
+
+        counts = np.bincount(slots, minlength=self.slots)
+        self.heads = (self.heads + counts) % self.capacity
+        self.lens = np.minimum(self.lens + counts, self.capacity)
+
+    @property
+    def nbytes(self) -> int:
+        return sum([col.nbytes for col in self.data])
+
+
+class RingDataFrame:
+    """
+    Trajectory stored in a slot of a Slab : a fixed-size circular buffer of rows
+    sorted by their first column (the timestamp).
+    Only the last capacity rows are kept, so the memory is constant however long the flight is.
+    """
+
+    def __init__(self, slab:Slab, slot:int) -> None:
+        self.slab = slab
+        self.slot = slot
+        self.columns = slab.columns
+
+    @property
+    def capacity(self) -> int:
+        # read from the slab : it can grow (see Slab.reserve)
+        return self.slab.capacity
+
+    def setColums(self, names:list):
+        self.columns = {name:i for i, name in enumerate(names)}
+
+    def clear(self):
+        self.slab.heads[self.slot] = 0
+        self.slab.lens[self.slot] = 0
+
+    @property
+    def head(self) -> int:
+        return int(self.slab.heads[self.slot])
+
+    @property
+    def len(self) -> int:
+        return int(self.slab.lens[self.slot])
+
+    @property
+    def nbytes(self) -> int:
+        return self.slab.slot_nbytes
+
+    def __column__(self, c:int, start:int, stop:int) -> np.float64_1d[ax.time]:
+        """
+        Rows [start, stop[ of a column in chronological order (view, or one copy if they wrap around)
+        """
+        n = max(stop - start, 0)
+        first = (self.head - self.len + start) % self.capacity
+        col = self.slab.data[c][self.slot]
+        if (first + n <= self.capacity):
+            return self.slab.decode(c, col[first:first+n])
+        return self.slab.decode(c, np.concatenate([col[first:], col[:first+n-self.capacity]]))
+
+    def __rows__(self, start:int, stop:int) -> np.float64_2d[ax.time, ax.feature]:
+        """
+        Rows [start, stop[ in chronological order
+        """
+        rows = np.empty((max(stop - start, 0), len(self.slab.data)), dtype=np.float64)
+        for c in range(len(self.slab.data)):
+            rows[:, c] = self.__column__(c, start, stop)
+        return rows
+
+    def __search__(self, key) -> int:
+        # index of the first row with a timestamp >= key
+        # (usually the new message is the most recent : checked first)
+        length = self.len
+        if (length == 0 or self.last_key() < key):
+            return length
+        return int(np.searchsorted(self.__column__(0, 0, length), key))
+
+    def __physical__(self, i:int) -> int:
+        return (self.head - self.len + i) % self.capacity
+
+    def __write__(self, p:int, value) -> None:
+        slab = self.slab
+        for c in range(len(slab.data)):
+            v = value[c]
+            if (v != v and slab.integer[c]):
+                v = slab.missing[c]
+            slab.data[c][self.slot, p] = v
+
+    def __read__(self, p:int) -> np.float64_1d[ax.feature]:
+        row = np.array([col[self.slot, p] for col in self.slab.data], dtype=np.float64)
+        row[[row[c] == self.slab.missing[c] for c in range(len(row))]] = np.nan
+        return row
+
+
+    def add(self, value) -> bool:
+        return self.__put__(value, replace=False)
+
+    def set(self, value) -> bool:
+        return self.__put__(value, replace=True)
+
+    def __put__(self, value, replace:bool) -> bool:
+        key = value[0]
+        i = self.__search__(key)
+
+        if (i < self.len and self.slab.data[0][self.slot, self.__physical__(i)] == key):
+            if (replace):
+                self.__write__(self.__physical__(i), value)
+            return False
+
+        length = self.len
+        if (i == length):
+            # fast path : append, overwriting the oldest row when full
+            head = self.head
+            self.__write__(head, value)
+            self.slab.heads[self.slot] = (head + 1) % self.capacity
+            self.slab.lens[self.slot] = min(length + 1, self.capacity)
+            return True
+
+        # late message : shift the more recent rows by one in place (overwriting the oldest row when full).
+        # Late messages are only a few seconds late, so only a few rows move
+        if (length == self.capacity and i == 0):
+            return True # older than every row kept
+        src = (self.head - length + np.arange(i, length)) % self.capacity
+        dst = (src + 1) % self.capacity
+        for col in self.slab.data:
+            col[self.slot, dst] = col[self.slot, src]
+        self.__write__(self.__physical__(i), value)
+        self.slab.heads[self.slot] = (self.head + 1) % self.capacity
+        self.slab.lens[self.slot] = min(length + 1, self.capacity)
+        return True
+
+
+    def last(self) -> np.float64_1d[ax.feature]:
+        if (self.len == 0):
+            return None
+        return self.__read__((self.head - 1) % self.capacity)
+
+    def last_key(self) -> float:
+        """
+        Timestamp of the last row (nan if empty)
+        """
+        if (self.len == 0):
+            return np.nan
+        return self.slab.data[0][self.slot, (self.head - 1) % self.capacity]
+
+    def get(self, key) -> np.float64_1d[ax.feature]:
+        i = self.__search__(key)
+        if (i >= self.len or self.slab.data[0][self.slot, self.__physical__(i)] != key):
+            return None
+        return self.__read__(self.__physical__(i))
+
+    def window(self, length:int) -> np.float64_2d[ax.time, ax.feature]:
+        """
+        Last rows of the buffer
+        """
+        return self.__rows__(max(self.len - length, 0), self.len)
+
+    def getColumns(self, names:list)-> np.float64_2d[ax.time, ax.feature]:
+        cols = [self.__column__(self.columns[name], 0, self.len) for name in names]
+        return np.stack(cols, axis=1) if len(cols) > 0 else np.zeros((self.len, 0))
+
+    def to_numpy(self) -> np.float64_2d[ax.time, ax.feature]:
+        return self.__rows__(0, self.len)
+
+
+    def __str__(self) -> str:
+        return str(self.to_numpy())
+    def __repr__(self) -> str:
+        return str(self.to_numpy())
+    def __len__(self):
+        return self.len
+    # [] operator
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.__column__(self.columns[key], 0, self.len)
+
+        if isinstance(key, slice) and (key.step is None or key.step == 1):
+            start, stop, _ = key.indices(self.len)
+            return DataFrame.wrap(self.__rows__(start, stop), self.columns.copy())
+
+        value = self.to_numpy()[key]
+        if isinstance(value, np.ndarray) and len(value.shape) == 2:
+            sub = DataFrame(value)
+            sub.columns = self.columns.copy()
+            return sub
+
+        return value
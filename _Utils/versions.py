@@ -0,0 +1,64 @@
+import shutil
+import uuid
+
+from _Utils.os_wrapper import os
+
+
+# |====================================================================================================================
+# | VERSIONED FOLDERS : data written once, then published atomically
+# |====================================================================================================================
+
+# A versioned folder holds numbered subfolders, the highest one is the current version.
+# A version is written in a temporary folder unique to the writer, then renamed to the next number :
+# readers never see a partial version, and a version is never modified, as other processes
+# may still have its files memory mapped (on Windows, they can't be deleted until they close them).
+
+
+def versions(path:str) -> "list[int]":
+    if (path is None or not(os.path.isdir(path))):
+        return []
+    return sorted([int(f) for f in os.listdir(path) if f.isdigit()])
+
+
+def latest(path:str) -> "str|None":
+    """
+    Folder of the current version (None if nothing was published yet)
+    """
+    published = versions(path)
+    if (len(published) == 0):
+        return None
+    return os.path.join(path, str(published[-1]))
+
+
+def new_version(path:str) -> str:
+    """
+    Create the temporary folder of a new version
+    """
+    os.makedirs(path, exist_ok=True)
+    tmp = os.path.join(path, "tmp." + str(os.getpid()) + "." + uuid.uuid4().hex)
+    os.makedirs(tmp)
+    return tmp
+
+
+def publish(path:str, tmp:str) -> str:
+    """
+    Rename a written temporary folder as the next version, and return its folder.
+    The older versions are removed once nobody maps them anymore (else, retried on the next publish)
+    """
+    published = versions(path)
+    version = published[-1] + 1 if (len(published) > 0) else 0
+    while (True):
+        folder = os.path.join(path, str(version))
+        try:
+            os.rename(tmp, folder)
+            break
+        except OSError:
+            if not(os.path.exists(folder)):
+                raise
+            # taken by another process in the meantime
+            version += 1
+
+    for old in versions(path):
+        if (old < version):
+            shutil.rmtree(os.path.join(path, str(old)), ignore_errors=True)
+    return folder
@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+from D_DataLoader.Utils import AirportIndex, airport_distances
+
+
+def test_antimeridian():
+    # 0.2 degrees of longitude apart (~22 km), on both sides of the antimeridian
+    index = AirportIndex(np.array([0.0]), np.array([179.9]))
+    dists = index.distances(np.array([0.0]), np.array([-179.9]))
+    assert 20 < dists[0, 0] < 25
+
+
+def test_same_as_dense():
+    rng = np.random.default_rng(0)
+    a_lats, a_lons = rng.uniform(-80, 80, 300), rng.uniform(-180, 180, 300)
+    lats, lons = rng.uniform(-80, 80, 500), rng.uniform(-180, 180, 500)
+    lons[:100] = rng.choice([-1, 1], 100) * rng.uniform(179, 180, 100)
+    a_lons[:50] = rng.choice([-1, 1], 50) * rng.uniform(179, 180, 50)
+    lats[:100], a_lats[:50] = rng.uniform(-1, 1, 100), rng.uniform(-1, 1, 50)
+
+    dense = airport_distances(lats, lons, a_lats, a_lons)
+    assert np.allclose(AirportIndex(a_lats, a_lons).distances(lats, lons), dense, equal_nan=True)
+
+
+def test_pole():
+    # across the pole : 0.1 + 0.05 degree of latitude (~16.7 km)
+    index = AirportIndex(np.array([89.9]), np.array([0.0]))
+    dists = index.distances(np.array([89.95]), np.array([180.0]))
+    assert np.allclose(dists, airport_distances(np.array([89.95]), np.array([180.0]), np.array([89.9]), np.array([0.0])))
+    assert 15 < dists[0, 0] < 18
+
+    rng = np.random.default_rng(1)
+    a_lats, a_lons = rng.uniform(88, 90, 100) * rng.choice([-1, 1], 100), rng.uniform(-180, 180, 100)
+    lats, lons = rng.uniform(87, 90, 500) * rng.choice([-1, 1], 500), rng.uniform(-180, 180, 500)
+    dense = airport_distances(lats, lons, a_lats, a_lons)
+    assert np.allclose(AirportIndex(a_lats, a_lons).distances(lats, lons), dense)
+
+
+def test_no_airport():
+    index = AirportIndex(np.zeros(0), np.zeros(0))
+    dists = index.distances(np.array([43.0, np.nan]), np.array([1.0, np.nan]))
+    assert dists.shape == (2, 0)
+    rows, airports, near = index.query(np.array([43.0]), np.array([1.0]))
+    assert len(rows) == len(airports) == len(near) == 0
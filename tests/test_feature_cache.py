@@ -0,0 +1,33 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+from D_DataLoader.FeatureCache import FeatureCache
+
+
+CTX = {"USED_FEATURES":["latitude", "longitude", "timestamp"], "INPUT_PADDING":"valid", "HISTORY":8}
+
+
+def test_get_after_save(tmp_path):
+    files = []
+    for name in ["a.csv", "b.csv", "c.csv"]:
+        files.append(str(tmp_path / name))
+        with open(files[-1], "w") as f:
+            f.write(name)
+
+    cache = FeatureCache(CTX, str(tmp_path), str(tmp_path / "cache"))
+    array = np.arange(12, dtype=np.float64).reshape(4, 3)
+    cache.put(files[0], array, "abc")
+    cache.put(files[1], np.zeros((0, 3)), "def")
+    cache.put(files[2], None, "ghi")
+    cache.save()
+
+    cache = FeatureCache(CTX, str(tmp_path), str(tmp_path / "cache"))
+    x, meta = cache.get(files[0])
+    assert np.array_equal(x, array) and meta == "abc"
+    # an empty trajectory is an empty array, with the features axis
+    x, meta = cache.get(files[1])
+    assert x.shape == (0, 3) and meta == "def"
+    x, meta = cache.get(files[2])
+    assert x is None and meta == "ghi"
@@ -0,0 +1,100 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+import _Utils.FeatureGetter as FG
+
+CTX = {
+    "HISTORY":32, "INPUT_LEN":32, "HASH_SEGMENTS":4, "WHILDCARD_LIMIT":5,
+    "MATCH_THRESHOLD":10, "MATCH_MARGIN":3, "PROBE_CHUNK":16, "BUILD_WORKERS":1,
+    "PLOT_HASHED_TIMESERIES":False,
+    "USED_FEATURES":["latitude", "longitude"], "FEATURE_MAP":{"latitude":0, "longitude":1}, "FEATURES_IN":2,
+}
+FG.init(CTX)
+
+from B_Model.ReplaySolver.HASH import Model
+from B_Model.ReplaySolver.Utils.index import HashIndex, MISSING
+
+
+def flights(nb:int, length:int=300, seed:int=0) -> "tuple[list[np.float64_2d], list[str]]":
+    """
+    Random smooth trajectories (lat, lon)
+    """
+    rng = np.random.default_rng(seed)
+    x, y = [], []
+    for f in range(nb):
+        track = np.radians(np.cumsum(rng.normal(0, 8, length)))
+        lat = 43 + np.cumsum(0.001 * np.cos(track))
+        lon = 1 + np.cumsum(0.001 * np.sin(track))
+        x.append(np.stack([lat, lon], axis=-1))
+        y.append("f" + str(f))
+    return x, y
+
+
+def entries(index:HashIndex) -> "dict[int, tuple[object, int]]":
+    """
+    hash -> (file name or COLLIDED, window) of every hash having a live posting
+    """
+    hashes = index.__hashes__()
+    files, windows = index.lookup(hashes)
+    return {h:(index.names[f] if f >= 0 else f, w)
+            for h, f, w in zip(hashes.tolist(), files.tolist(), windows.tolist()) if f != MISSING}
+
+
+def colliding_flights() -> "tuple[list[np.float64_2d], list[str]]":
+    """
+    Flights sharing some of their windows : each one starts with a piece of the previous one
+    """
+    x, y = flights(12)
+    for f in range(1, len(x)):
+        x[f][:80] = x[f-1][100:180]
+    return x, y
+
+
+def test_remove_uncollides():
+    x, y = colliding_flights()
+    model = Model(CTX)
+    model.add_flights(x, y)
+    assert model.index.collisions > 0
+
+    # remove and re-ingest some flights (e.g. a nightly update)
+    for f in ["f3", "f7", "f8"]:
+        model.remove_flight(f)
+    model.add_flights([x[7]], ["f7"])
+    removed = model.index.collisions
+    model.index.compact()
+    assert model.index.collisions == removed
+
+    keep = [f for f in range(len(x)) if y[f] not in ["f3", "f8"]]
+    fresh = Model(CTX)
+    fresh.add_flights([x[f] for f in keep], [y[f] for f in keep])
+
+    assert entries(model.index) == entries(fresh.index)
+    assert model.index.collisions == fresh.index.collisions
+    assert len(model.index) == len(fresh.index)
+    # no posting is left for the removed flights
+    assert len(model.index.files) == len(fresh.index.files)
+
+
+def test_save_open(tmp_path):
+    x, y = flights(20)
+    model = Model(CTX)
+    model.add_flights(x, y)
+    path = str(tmp_path / "db")
+    model.save(path)
+    expected = model.query(x[:10])
+
+    # saved again while its files are memory mapped
+    loaded = Model(CTX)
+    loaded.load(path)
+    loaded.save(path)
+    loaded.save(path)
+
+    reloaded = Model(CTX)
+    reloaded.load(path)
+    assert entries(reloaded.index) == entries(model.index)
+    assert sorted(reloaded.ts) == sorted(model.ts)
+    assert all(np.array_equal(reloaded.ts[f], model.ts[f]) for f in model.ts)
+    result = reloaded.query(x[:10])
+    assert result[0] == expected[0] and np.array_equal(result[1], expected[1])
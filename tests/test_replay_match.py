@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from _Utils.numpy import np
+from test_hash_index import CTX, Model, flights
+from B_Model.ReplaySolver.Utils import hashing
+
+
+def reference(model:Model, ts:"list[np.int8_1d]") -> "tuple[list[str], list[int], list[str], list[int], list[int]]":
+    """
+    Votes of every window, counted one by one (no early termination)
+    """
+    keys, samples, windows = hashing.batch_keys(ts, model.CTX)
+    files, stored = model.index.lookup(keys)
+    matches = {(s, w, f, o) for s, w, f, o in zip(samples.tolist(), windows.tolist(),
+                                                     files.tolist(), (stored - windows).tolist()) if f >= 0}
+    votes = {}
+    for s, _, f, o in matches:
+        votes[(s, f, o)] = votes.get((s, f, o), 0) + 1
+    file_votes = {}
+    for (s, f, _), count in votes.items():
+        file_votes[(s, f)] = max(file_votes.get((s, f), 0), count)
+
+    result = ([], [], [], [], [])
+    for s in range(len(ts)):
+        ranked = sorted([(-count, f) for (s_, f), count in file_votes.items() if s_ == s])
+        ranked += [(0, -1)] * 2
+        result[0].append(model.index.names[ranked[0][1]] if ranked[0][1] >= 0 else None)
+        result[1].append(-ranked[0][0])
+        result[2].append(model.index.names[ranked[1][1]] if ranked[1][1] >= 0 else None)
+        result[3].append(-ranked[1][0])
+        result[4].append(len(ranked) - 2)
+    return result
+
+
+def queries(x:"list[np.float64_2d]") -> "list[np.float64_2d]":
+    """
+    Noisy pieces of the flights, some spliced from several flights
+    """
+    rng = np.random.default_rng(1)
+    q = [x[f][50:250] for f in range(0, len(x), 2)]
+    q += [np.concatenate([x[f][:100], x[(f+5) % len(x)][100:200], x[(f+9) % len(x)][:60]]) for f in range(0, len(x), 3)]
+    return [sample + rng.normal(0, 2e-5, sample.shape) for sample in q]
+
+
+def test_match_same_as_reference():
+    x, y = flights(20)
+    model = Model(dict(CTX, MATCH_THRESHOLD=10**9))
+    model.add_flights(x, y)
+
+    labels, offsets = model.__fingerprint_batch__(queries(x))
+    ts = [labels[offsets[s]:offsets[s+1]] for s in range(len(offsets) - 1)]
+    result = model.__match__(ts)
+    expected = reference(model, ts)
+
+    assert result[0] == expected[0] and result[2] == expected[2]
+    for i in [1, 3, 4]:
+        assert result[i].tolist() == expected[i]
+
+
+def test_match_early_termination():
+    x, y = flights(20)
+    model = Model(CTX)
+    model.add_flights(x, y)
+
+    labels, offsets = model.__fingerprint_batch__([sample[50:250] for sample in x])
+    ts = [labels[offsets[s]:offsets[s+1]] for s in range(len(offsets) - 1)]
+    best, score, _, runner_up_score, _ = model.__match__(ts)
+    expected = reference(model, ts)
+
+    # stopped early, on the right flight
+    assert best == y == expected[0]
+    assert np.all(score >= CTX["MATCH_THRESHOLD"])
+    assert np.all(score >= CTX["MATCH_MARGIN"] * runner_up_score)
+    assert np.all(score < expected[1])
@@ -0,0 +1,91 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+import pandas as pd
+import _Utils.FeatureGetter as FG
+
+CTX = {
+    "HISTORY":32, "INPUT_LEN":32, "HASH_SEGMENTS":4, "WHILDCARD_LIMIT":5,
+    "MATCH_THRESHOLD":10, "MATCH_MARGIN":3, "PROBE_CHUNK":16, "BUILD_WORKERS":1,
+    "PLOT_HASHED_TIMESERIES":False, "INPUT_PADDING":"nan",
+    "USED_FEATURES":["latitude", "longitude"], "FEATURE_MAP":{"latitude":0, "longitude":1}, "FEATURES_IN":2,
+}
+FG.init(CTX)
+
+from B_Model.ReplaySolver.HASH import Model
+from B_Model.ReplaySolver.Utils import hashing
+import D_DataLoader.Utils as U
+
+
+def recordings(nb:int, length:int=600, seed:int=0) -> "dict[str, pd.DataFrame]":
+    """
+    Random flights, with about 10% of the messages lost
+    """
+    rng = np.random.default_rng(seed)
+    dfs = {}
+    for f in range(nb):
+        track = np.radians(np.cumsum(rng.normal(0, 8, length)))
+        keep = rng.random(length) > 0.1
+        keep[0] = keep[-1] = True
+        dfs["f" + str(f)] = pd.DataFrame({
+            "timestamp":1600000000 + np.arange(length),
+            "latitude":43 + np.cumsum(0.001 * np.cos(track)),
+            "longitude":1 + np.cumsum(0.001 * np.sin(track))})[keep].reset_index(drop=True)
+        for col in ["groundspeed", "track", "vertical_rate", "onground", "alert", "spi",
+                    "squawk", "altitude", "geoaltitude"]:
+            dfs["f" + str(f)][col] = 0.0
+    return dfs
+
+
+def build(dfs:"dict[str, pd.DataFrame]") -> Model:
+    model = Model(CTX)
+    model.add_flights([U.df_to_feature_array(CTX, df.copy()) for df in dfs.values()], list(dfs.keys()))
+    return model
+
+
+def test_stream_pads_the_gaps():
+    dfs = recordings(10)
+    model = build(dfs)
+    df = dfs["f3"]
+
+    fp = model.new_stream()
+    digits = []
+    push = fp.push
+    fp.push = lambda digit: (digits.append(int(digit)), push(digit))
+    for i in range(len(df)):
+        pred = model.stream(fp, df["latitude"][i], df["longitude"][i], df["timestamp"][i])
+
+    # same digits as the stored (padded) fingerprint
+    assert np.array_equal(digits, model.ts["f3"])
+    assert pred == "f3"
+
+
+def test_long_gap_is_skipped():
+    dfs = recordings(10)
+    model = build(dfs)
+    df = dfs["f5"]
+    gap = 20 * 60
+    timestamps = df["timestamp"].to_numpy() + gap * (np.arange(len(df)) >= len(df) // 2)
+
+    # reference : every missing second probed
+    ref = model.new_stream()
+    for i in range(len(df)):
+        for _ in range(ref.gap(timestamps[i])):
+            model.__probe__(ref, np.nan, np.nan)
+        model.__probe__(ref, df["latitude"][i], df["longitude"][i])
+
+    probes = []
+    probe = model.__probe__
+    model.__probe__ = lambda *args: (probes.append(1), probe(*args))
+    fp = model.new_stream()
+    for i in range(len(df)):
+        model.stream(fp, df["latitude"][i], df["longitude"][i], timestamps[i])
+
+    # one probe per second, but only HISTORY+2 during the long gap
+    assert len(probes) == timestamps[-1] - timestamps[0] + 1 - gap + CTX["HISTORY"] + 2
+    assert fp.count == ref.count and fp.window == ref.window
+    assert np.array_equal(fp.seg_hashes, ref.seg_hashes)
+    assert fp.votes == ref.votes
+    assert (fp.match, fp.score) == (ref.match, ref.score)
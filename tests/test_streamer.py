@@ -0,0 +1,114 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+from _Utils.ADSB_Streamer import Streamer
+
+
+def message(icao:str, timestamp:int, **kwargs) -> "dict[str, object]":
+    msg = {"icao24":icao, "timestamp":timestamp, "latitude":43.0 + timestamp * 1e-3, "longitude":1.0}
+    msg.update(kwargs)
+    return msg
+
+
+def test_shared_tag_keeps_its_icao():
+    streamer = Streamer(ttl=60)
+
+    # a solver tags the messages of "abc", another one re-adds them with the tag as icao24
+    for t in range(1, 6):
+        streamer.add(message("abc", t), tag="abc_1")
+    for t in range(1, 6):
+        streamer.add(message("abc_1", t), tag="abc_1")
+
+    assert len(streamer.get("abc_1")) == 5
+    assert streamer.get_icao_for_tag("abc_1") == "abc"
+    assert streamer.get_tags_for_icao("abc") == {"abc_1"}
+    assert streamer.get_tags_for_icao("abc_1") == set()
+
+    # evicted by the ttl : no icao still refers to the tag
+    streamer.add(message("def", 1000))
+    assert streamer.get("abc_1") is None
+    assert streamer.get_tags_for_icao("abc") == set()
+    assert streamer.get_icao_for_tag("abc_1") is None
+
+
+def test_duplicated_message_is_stored_once():
+    streamer = Streamer()
+    for t in [1, 2, 3, 2, 3]:
+        streamer.add(message("abc", t))
+    # a copy of the message (not the same dict) is a duplicate too
+    streamer.add(dict(message("abc", 3)))
+    assert np.array_equal(streamer.get("abc")["timestamp"], [1, 2, 3])
+
+
+def test_max_trajectories():
+    streamer = Streamer(max_trajectories=10)
+
+    for i in range(25):
+        streamer.add(message(f"a{i}", i + 1))
+        assert len(streamer.trajectories) <= 10
+    # the slab never grows past the limit : the slots of the evicted trajectories are reused
+    assert streamer.slab.slots == 10
+    assert set(streamer.trajectories) == {f"a{i}" for i in range(15, 25)}
+    assert streamer.get_tags_for_icao("a0") == set()
+
+    # same through add_batch, the trajectories of the batch are kept
+    batch = {"icao24":np.array([f"b{i}" for i in range(8)]), "timestamp":np.full(8, 100)}
+    streamer.add_batch(batch)
+    assert len(streamer.trajectories) == 10 and streamer.slab.slots == 10
+    assert {f"b{i}" for i in range(8)} <= set(streamer.trajectories)
+
+
+def test_memory_budget():
+    probe = Streamer()
+    slab_nbytes = probe.slab.nbytes
+    streamer = Streamer(memory_budget=slab_nbytes + 4000)
+
+    # the caches are charged to the budget : the least recently updated ones are evicted
+    for i in range(6):
+        streamer.add(message(f"a{i}", i + 1))
+        streamer.cache("solver", f"a{i}", np.zeros(100))
+    # checked on the next message
+    streamer.add(message("c", 7))
+    assert streamer.memory <= streamer.memory_budget
+    assert set(streamer.trajectories) == {"c"} | {f"a{i}" for i in range(1, 6)}
+
+    # the slab doesn't grow past the budget either
+    for i in range(200):
+        streamer.add(message(f"b{i}", 10 + i))
+    assert streamer.slab.slots == probe.slab.slots
+    assert streamer.memory <= streamer.memory_budget
+
+
+def test_add_batch_same_as_add():
+    rng = np.random.default_rng(0)
+    # (a7 jumps 3000 seconds ahead : the others are kept, as the eviction order of a tick may differ)
+    batched, single = Streamer(ttl=10**6), Streamer(ttl=10**6)
+
+    # the same ticks, with late, duplicated, unordered and missing values, and long gaps
+    msgs = []
+    for t in range(1, 60):
+        tick = []
+        for i in range(8):
+            if (rng.random() < 0.3):
+                continue
+            timestamp = t + (3000 if i == 7 and t > 30 else 0) - int(rng.random() < 0.1) * 2
+            msg = message(f"a{i}", timestamp, altitude=str(rng.integers(1000, 2000)),
+                          onground=["True", "False", ""][rng.integers(3)])
+            if (rng.random() < 0.1):
+                msg["tag"] = f"a{i}_1"
+            tick.append(msg)
+        tick += [dict(tick[j]) for j in rng.integers(len(tick), size=2)]
+        rng.shuffle(tick)
+        msgs.append(tick)
+
+    for tick in msgs:
+        batched.add_messages(tick)
+        for msg in tick:
+            single.add(msg, tag=msg.get("tag", msg["icao24"]))
+
+    assert set(batched.trajectories) == set(single.trajectories)
+    for tag in single.trajectories:
+        assert np.array_equal(batched.get(tag).to_numpy(), single.get(tag).to_numpy(), equal_nan=True)
+        assert batched.get_icao_for_tag(tag) == single.get_icao_for_tag(tag)
@@ -0,0 +1,39 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from _Utils.numpy import np
+from _Utils.ADSB_Streamer import STREAMER
+import C_Constants.TrajectorySeparator.Model as MODEL
+from D_DataLoader.TrajectorySeparator.DataLoader import StreamerInterface
+
+
+class Loader:
+    CTX = {"USED_FEATURES":MODEL.USED_FEATURES}
+
+
+def test_flights_with_icaos():
+    STREAMER.clear()
+    streamer = StreamerInterface(Loader())
+
+    # abc_0 and abc_1 share an icao, abc_1 already has a message at the timestamp 20
+    lengths = {"abc_0":5, "abc_1":20, "def_0":300}
+    for tag, length in lengths.items():
+        for t in range(1, length + 1):
+            streamer.stream({"icao24":tag[:3], "tag":tag, "timestamp":t,
+                             "latitude":43.0 + t * 1e-3, "longitude":1.0 + len(tag) * 1e-3})
+
+    flights = streamer.get_flights_with_icaos(["abc", "def", "ghi"], [20, 301, 1])
+    assert sorted(flights[0][1]) == ["abc_0"]
+    assert flights[1][1] == ["def_0"] and flights[2] == ([], [])
+
+    for (x, tags) in flights[:2]:
+        for sample, tag in zip(x, tags):
+            expected = STREAMER.get(tag).getColumns(MODEL.USED_FEATURES)
+            assert np.array_equal(sample, expected)
+    # only the last capacity messages are kept
+    assert len(flights[1][0][0]) == STREAMER.capacity
+
+    x, tags = streamer.get_flights_with_icao("abc", 20)
+    assert tags == ["abc_0"] and np.array_equal(x[0], flights[0][0][0])
+    STREAMER.clear()